@@ -0,0 +1,297 @@
+#BENCHMARKS FOR THE B-TREE INDEX
+#usage: python3 bench.py read-path [--keys N] [--lookups N] [--cache N] [--block-size N]
+#       python3 bench.py search [--keys N] [--lookups N] [--block-size N]
+#       python3 bench.py insert [--keys N] [--cache N] [--group-size N]
+#       python3 bench.py threads [--keys N] [--lookups N] [--cache N] [--threads N ...] [--storage MODE]
+#       python3 bench.py suite [--keys N ...] [--workloads NAME ...] [--lookups N] [--cache N] [--block-size N] [--wal] [--profile [ROWS]]
+
+#importing the required libraries
+import argparse
+import cProfile
+import os
+import pstats
+import random
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from io import StringIO
+from itertools import accumulate
+
+from main import BLOCK_SIZE, BTree, STORAGE_MODES
+
+#Builds an index of `keys` random keys with a bulk load and returns its file name
+def build_index(directory, keys, block_size=BLOCK_SIZE, seed=0):
+    rng = random.Random(seed)
+    csv_name = os.path.join(directory, 'bench.csv')
+    index_name = os.path.join(directory, 'bench.db')
+    with open(csv_name, 'w') as f: #Random keys, value = key * 2
+        for key in rng.sample(range(1, keys * 10), keys):
+            f.write(f"{key},{key * 2}\n")
+    btree = BTree(index_name)
+    with redirect_stdout(StringIO()): #Keep the per-command messages out of the report
+        btree.create_file(block_size)
+        btree.load(csv_name, bulk=True)
+    btree.close_file()
+    return index_name, csv_name
+
+#Inserts one pair the way the query server does: the insert and its commit, without the message BTree.insert
+#prints, so the timings measure the tree and not the formatting of that message
+def put(btree, key, value):
+    btree._insert(key, value)
+    btree._commit()
+
+#Reads the keys of the CSV file back
+def read_keys(csv_name):
+    with open(csv_name) as f:
+        return [int(line.split(',')[0]) for line in f]
+
+#Times `lookups` random searches against every storage mode
+def bench_read_path(args):
+    with tempfile.TemporaryDirectory() as directory:
+        index_name, csv_name = build_index(directory, args.keys, args.block_size)
+        rng = random.Random(1)
+        keys = read_keys(csv_name)
+        probes = [rng.choice(keys) for _ in range(args.lookups)] #Same probes for every mode
+        print(f"{args.keys} keys, {args.lookups} random lookups, {args.block_size} byte blocks, cache of {args.cache} blocks")
+        for storage in STORAGE_MODES:
+            btree = BTree(index_name, cache_blocks=args.cache)
+            btree.open_file('rb', storage=storage)
+            start = time.perf_counter()
+            for key in probes:
+                btree.search(key, show_error=False)
+            elapsed = time.perf_counter() - start
+            stats = btree.cache_stats()
+            btree.close_file()
+            print(f"{storage:>6}: {args.lookups / elapsed:12,.0f} lookups/sec  "
+                  f"({stats['blocks_read']} blocks read, hit rate {stats['hit_rate']:.1%})")
+
+#The search the tree used before binary search: linear scan of the keys and one recursive call per level
+def linear_search(btree, node, key):
+    i = 0
+    while i < node.num_keys and key > node.keys[i]:
+        i += 1
+    if i < node.num_keys and key == node.keys[i]:
+        return node.values[i]
+    if node.is_leaf:
+        return None
+    return linear_search(btree, btree.load_node(node.children[i]), key)
+
+#Times in-node lookup and descent with every node cached, so only the CPU cost of the search is measured
+def bench_search(args):
+    with tempfile.TemporaryDirectory() as directory:
+        index_name, csv_name = build_index(directory, args.keys, args.block_size)
+        rng = random.Random(1)
+        keys = read_keys(csv_name)
+        probes = [rng.choice(keys) for _ in range(args.lookups)]
+        btree = BTree(index_name, cache_blocks=args.keys) #Large enough for the whole tree
+        btree.open_file('rb')
+        for key in keys: #Warm the cache
+            btree.search(key, show_error=False)
+        print(f"{args.keys} keys, {args.lookups} random lookups, {args.block_size} byte blocks, every node cached")
+        searches = {
+            'linear + recursive': lambda key: linear_search(btree, btree.load_node(btree.header.root_id), key),
+            'bisect + iterative': lambda key: btree.search(key, show_error=False),
+        }
+        for name, search in searches.items():
+            start = time.perf_counter()
+            for key in probes:
+                search(key)
+            elapsed = time.perf_counter() - start
+            print(f"{name:>20}: {args.lookups / elapsed:12,.0f} lookups/sec")
+        btree.close_file()
+
+#Times random inserts without the write-ahead log, with an fsync per insert and with group commit
+def bench_insert(args):
+    rng = random.Random(2)
+    keys = rng.sample(range(1, args.keys * 10), args.keys)
+    modes = {
+        'no log (not durable)': {},
+        'log, fsync per insert': {'wal': True, 'group_size': 1},
+        f'log, groups of {args.group_size}': {'wal': True, 'group_size': args.group_size, 'commit_interval': 1.0},
+    }
+    print(f"{args.keys} random inserts, cache of {args.cache} blocks")
+    with tempfile.TemporaryDirectory() as directory:
+        for number, (name, options) in enumerate(modes.items()):
+            btree = BTree(os.path.join(directory, f'insert{number}.db'), cache_blocks=args.cache, **options)
+            with redirect_stdout(StringIO()): #Keep the per-insert messages out of the report
+                btree.create_file()
+                start = time.perf_counter()
+                for key in keys:
+                    put(btree, key, key)
+                btree.close_file() #Includes the final write-back / checkpoint
+            elapsed = time.perf_counter() - start
+            print(f"{name:>24}: {args.keys / elapsed:12,.0f} inserts/sec")
+
+#Times random lookups on one concurrent tree shared by a growing number of reader threads
+def bench_threads(args):
+    with tempfile.TemporaryDirectory() as directory:
+        index_name, csv_name = build_index(directory, args.keys)
+        rng = random.Random(1)
+        keys = read_keys(csv_name)
+        print(f"{args.keys} keys, {args.lookups} random lookups per run, cache of {args.cache} blocks, {args.storage} storage")
+        for thread_count in args.threads:
+            btree = BTree(index_name, cache_blocks=args.cache, concurrent=True)
+            btree.open_file('rb', storage=args.storage)
+            share = args.lookups // thread_count #Lookups per thread
+            probes = [[rng.choice(keys) for _ in range(share)] for _ in range(thread_count)]
+            def lookups(batch):
+                for key in batch:
+                    btree.search(key, show_error=False)
+            threads = [threading.Thread(target=lookups, args=(batch,)) for batch in probes]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            btree.close_file()
+            print(f"{thread_count:>3} threads: {share * thread_count / elapsed:12,.0f} lookups/sec")
+
+WORKLOADS = ('seq', 'random', 'skewed') #Key workloads of the suite
+
+#Keys of a workload in insertion order: 1..count ascending for seq, distinct random keys in random order otherwise
+def workload_keys(workload, count, rng):
+    if workload == 'seq':
+        return list(range(1, count + 1))
+    return rng.sample(range(1, count * 10), count)
+
+#Keys to look up: uniform over the keys, except for skewed where the key of rank r is picked with weight 1/r
+#(Zipf), the ranks being shuffled so the hot keys are spread over the tree
+def workload_probes(workload, keys, lookups, rng):
+    if workload == 'skewed':
+        ranked = keys[:]
+        rng.shuffle(ranked)
+        weights = list(accumulate(1 / rank for rank in range(1, len(ranked) + 1)))
+        return rng.choices(ranked, cum_weights=weights, k=lookups)
+    return [rng.choice(keys) for _ in range(lookups)]
+
+#Calls op on every item and returns the seconds taken and the sorted latency of every call in nanoseconds.
+#The profiler, if any, only runs around the calls
+def timed(op, items, profiler=None):
+    clock = time.perf_counter_ns
+    latencies = []
+    if profiler:
+        profiler.enable()
+    start = clock()
+    for item in items:
+        before = clock()
+        op(item)
+        latencies.append(clock() - before)
+    elapsed = (clock() - start) / 1e9
+    if profiler:
+        profiler.disable()
+    latencies.sort()
+    return elapsed, latencies
+
+#Latency at a fraction of the sorted latencies, in microseconds
+def percentile(latencies, fraction):
+    return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] / 1000
+
+#Throughput, latency percentiles and the block/cache counters of one phase of the suite
+def report(name, count, elapsed, before, after, latencies=None, unit='ops'):
+    line = f"  {name:<11} {count / elapsed:12,.0f} {unit}/sec"
+    if latencies:
+        line += "  " + " ".join(f"{label} {percentile(latencies, fraction):7.1f}us"
+                                for label, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0)))
+    hits = after['hits'] - before['hits']
+    lookups = hits + after['misses'] - before['misses']
+    line += (f"  blocks read {after['blocks_read'] - before['blocks_read']:,} written {after['blocks_written'] - before['blocks_written']:,}"
+             f"  hit rate {hits / lookups if lookups else 0:.1%}")
+    if 'wal_pages_logged' in after: #Blocks go to the log first and reach the file at checkpoints
+        line += f"  logged {after['wal_pages_logged'] - before['wal_pages_logged']:,}"
+    print(line)
+
+#Runs every workload at every size: inserts (written back at the end), lookups, a full scan and extracts in both
+#formats, then the shape of the tree. With --profile the inserts and lookups run under cProfile
+def bench_suite(args):
+    quiet = open(os.devnull, 'w') #Per-command messages of the tree go here
+    print(f"{args.block_size} byte blocks, cache of {args.cache} blocks, {args.lookups} lookups per run"
+          f"{', write-ahead log' if args.wal else ''}")
+    with tempfile.TemporaryDirectory() as directory:
+        for count in args.keys:
+            for workload in args.workloads:
+                rng = random.Random(count)
+                keys = workload_keys(workload, count, rng)
+                probes = workload_probes(workload, keys, args.lookups, rng)
+                profilers = {'insert': cProfile.Profile(), 'search': cProfile.Profile()} if args.profile else {}
+                print(f"\n{workload}, {count:,} keys")
+                index_name = os.path.join(directory, f'{workload}{count}.db')
+                btree = BTree(index_name, cache_blocks=args.cache, wal=args.wal)
+                with redirect_stdout(quiet):
+                    btree.create_file(args.block_size, overwrite=True)
+                    before = btree.cache_stats()
+                    elapsed, latencies = timed(lambda key: put(btree, key, key), keys, profilers.get('insert'))
+                    start = time.perf_counter()
+                    btree.flush() #Dirty nodes still in the pool are part of the cost of the inserts
+                    elapsed += time.perf_counter() - start
+                report('insert', count, elapsed, before, btree.cache_stats(), latencies)
+                before = btree.cache_stats()
+                elapsed, latencies = timed(lambda key: btree.search(key, show_error=False), probes, profilers.get('search'))
+                report('search', len(probes), elapsed, before, btree.cache_stats(), latencies)
+                before = btree.cache_stats()
+                start = time.perf_counter()
+                pairs = sum(1 for _ in btree.scan())
+                report('scan', pairs, time.perf_counter() - start, before, btree.cache_stats(), unit='pairs')
+                for fmt in ('csv', 'bin'):
+                    output = os.path.join(directory, f'extract.{fmt}')
+                    before = btree.cache_stats()
+                    start = time.perf_counter()
+                    with redirect_stdout(quiet):
+                        btree.extract(output, overwrite=True)
+                    elapsed = time.perf_counter() - start
+                    report(f'extract {fmt}', pairs, elapsed, before, btree.cache_stats(), unit='pairs')
+                shape = btree.tree_stats()
+                print(f"  tree        height {shape['height']}, {shape['nodes']:,} nodes, fill factor {shape['fill_factor']:.1%} "
+                      f"(leaves {shape['leaf_fill_factor']:.1%}), {shape['file_blocks']:,} blocks in the file")
+                with redirect_stdout(quiet):
+                    btree.close_file()
+                for phase, profiler in profilers.items():
+                    print(f"\n  cProfile of the {phase} phase (by cumulative time):")
+                    pstats.Stats(profiler, stream=sys.stdout).sort_stats('cumulative').print_stats(args.profile)
+    quiet.close()
+
+#MAIN FUNCTION
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the B-tree index.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    read_path = commands.add_parser('read-path', help="compare the seek/read and mmap storage modes on random lookups")
+    read_path.add_argument('--keys', type=int, default=200000, help="keys in the index")
+    read_path.add_argument('--lookups', type=int, default=100000, help="random lookups to time")
+    read_path.add_argument('--cache', type=int, default=3, help="buffer pool size in blocks")
+    read_path.add_argument('--block-size', type=int, default=BLOCK_SIZE, help="block size of the index")
+    read_path.set_defaults(run=bench_read_path)
+    search = commands.add_parser('search', help="compare linear/recursive and binary/iterative search with every node cached")
+    search.add_argument('--keys', type=int, default=200000, help="keys in the index")
+    search.add_argument('--lookups', type=int, default=200000, help="random lookups to time")
+    search.add_argument('--block-size', type=int, default=BLOCK_SIZE, help="block size of the index")
+    search.set_defaults(run=bench_search)
+    insert = commands.add_parser('insert', help="compare inserts without the write-ahead log, with an fsync per insert and with group commit")
+    insert.add_argument('--keys', type=int, default=20000, help="keys to insert")
+    insert.add_argument('--cache', type=int, default=64, help="buffer pool size in blocks")
+    insert.add_argument('--group-size', type=int, default=64, help="commits per log fsync")
+    insert.set_defaults(run=bench_insert)
+    threads = commands.add_parser('threads', help="lookup throughput of a concurrent tree as reader threads are added")
+    threads.add_argument('--keys', type=int, default=200000, help="keys in the index")
+    threads.add_argument('--lookups', type=int, default=100000, help="random lookups per thread count")
+    threads.add_argument('--cache', type=int, default=1024, help="buffer pool size in blocks")
+    threads.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8], help="thread counts to time")
+    threads.add_argument('--storage', choices=['pread', 'mmap'], default='pread', help="storage mode")
+    threads.set_defaults(run=bench_threads)
+    suite = commands.add_parser('suite', help="insert/search/scan/extract throughput, latency, tree shape and block counters per workload")
+    suite.add_argument('--keys', type=int, nargs='+', default=[10000, 100000], help="index sizes to run")
+    suite.add_argument('--workloads', choices=WORKLOADS, nargs='+', default=list(WORKLOADS),
+                       help="seq: ascending keys; random: random keys; skewed: random keys, Zipf-distributed lookups")
+    suite.add_argument('--lookups', type=int, default=100000, help="lookups per run")
+    suite.add_argument('--cache', type=int, default=64, help="buffer pool size in blocks")
+    suite.add_argument('--block-size', type=int, default=BLOCK_SIZE, help="block size of the index")
+    suite.add_argument('--wal', action='store_true', help="turn on the write-ahead log")
+    suite.add_argument('--profile', type=int, nargs='?', const=20, default=0, metavar='ROWS',
+                       help="profile inserts and lookups with cProfile and print the top ROWS functions")
+    suite.set_defaults(run=bench_suite)
+    args = parser.parse_args()
+    args.run(args)
+
+if __name__ == "__main__":
+    main()
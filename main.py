@@ -1,122 +1,1149 @@
 #MAIN PYTHON FILE FOR THE PROJECT 
 
 #importing the required libraries
+import argparse
+import asyncio
+import csv
+import io
 import os
+import mmap
+import signal
 import struct 
+import sys
+from array import array
+import heapq
+from bisect import bisect_left, bisect_right
+import tempfile
+import threading
+import time
+import zlib
 from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from itertools import islice
+from operator import itemgetter
 
 #CONSTATS + UTILITY FUNCTIONS
 MAGIC_NUMBER = b'4337PRJ3'
-BLOCK_SIZE = 512
-DEGREE = 10
-MAX_KEYS = 2*DEGREE - 1
-MAX_CHILDREN = MAX_KEYS + 1
+BLOCK_SIZE = 512 #Block size of files created before the block size was stored in the header
+DEGREE = 10 #Degree of those files
+MIN_BLOCK_SIZE = 512 #Block sizes must be a power of two in this range
+MAX_BLOCK_SIZE = 1 << 20
+DEFAULT_CACHE_BLOCKS = 3 #Nodes kept in memory when no cache size is given
+BULK_RUN_SIZE = 1000000 #Number of rows sorted in memory before a run is spilled to disk during a bulk load
+BULK_WRITE_SIZE = 1 << 20 #Bytes buffered before a bulk load writes them out
+PAIR_FORMAT = struct.Struct('>QQ') #Fixed width key-value record of binary files and of the sorted runs of a bulk load
+EXPORT_BATCH_SIZE = 65536 #Pairs encoded and written at a time by EXTRACT
+WAL_SUFFIX = '.wal' #The write-ahead log of an index file is kept next to it under this suffix
+WAL_GROUP_SIZE = 64 #Commits grouped into one write + fsync of the log
+WAL_COMMIT_INTERVAL = 0.05 #Seconds a commit may wait for its group before the group is written anyway
+WAL_CHECKPOINT_BLOCKS = 4096 #Distinct blocks logged before they are copied into the index file
+WAL_RECORD_FORMAT = struct.Struct('>cQI') #Record type, block ID (page) or commit number (commit), CRC-32
+SERVER_HOST = '127.0.0.1' #Address the query server listens on by default (local connections only)
+SERVER_PORT = 7337 #TCP port of the query server
+NODE_HEAD_FORMAT = struct.Struct('>QQQ') #Block ID, Parent ID, Number of keys
+FREE_BLOCK = 2**64 - 1 #Number of keys of a block on the free list (its parent ID slot holds the next free block)
+OVERFLOW_BLOCK = 2**64 - 2 #Number of keys of an overflow page (its parent ID slot holds the next page of the value)
+KEYS_FIXED = 0 #Key format of files whose keys and values are unsigned 64-bit integers in fixed slots (BTreeNode)
+KEYS_BYTES = 1 #Key format of files whose keys and values are byte strings in slotted pages (SlottedNode)
+KEY_FORMATS = {'int': KEYS_FIXED, 'bytes': KEYS_BYTES} #Names of the key formats
+MAX_SLOTTED_BLOCK_SIZE = 1 << 16 #Largest block size of slotted pages (cell offsets are 16-bit)
+PAGE_HEAD_FORMAT = struct.Struct('>QQQQ') #Block ID, Parent ID, Number of keys, First child (slotted pages)
+SLOT_FORMAT = struct.Struct('>H') #Offset of a cell in a slotted page
+CELL_HEAD_FORMAT = struct.Struct('>HHI') #Key bytes shared with the previous key, bytes of the rest of the key, value length
+BYTE_PAIR_FORMAT = struct.Struct('>HI') #Key and value lengths that start a binary record of byte strings
+CHILD_FORMAT = struct.Struct('>Q') #A single child pointer
+NATIVE_LITTLE_ENDIAN = sys.byteorder == 'little' #array('Q') uses the native byte order
 #helper function to create the blank block
-def blank_block():
-    return b'\x00'*BLOCK_SIZE
+def blank_block(block_size=BLOCK_SIZE):
+    return b'\x00'*block_size
+#Largest degree whose nodes fit in a block: a node takes 24 + 8 * (6*degree - 2) bytes
+#(block ID, parent ID, number of keys, 2*degree - 1 keys and values, 2*degree children)
+def max_degree(block_size):
+    return (block_size - 8) // 48
+
+#NODE LAYOUT CLASS
+#Sizes, offsets and struct formats of a node block for one block size and degree. Every index file records its
+#block size and degree in the header and all of its nodes share one layout
+class NodeLayout:
+    #Constructor: raises ValueError if the block size or degree is not usable
+    def __init__(self, block_size=BLOCK_SIZE, degree=DEGREE):
+        if block_size < MIN_BLOCK_SIZE or block_size > MAX_BLOCK_SIZE or block_size & (block_size - 1):
+            raise ValueError(f"block size {block_size} must be a power of two between {MIN_BLOCK_SIZE} and {MAX_BLOCK_SIZE}.")
+        if degree < 2 or degree > max_degree(block_size):
+            raise ValueError(f"degree {degree} must be between 2 and {max_degree(block_size)} for {block_size} byte blocks.")
+        self.block_size = block_size
+        self.degree = degree
+        self.max_keys = 2 * degree - 1
+        self.max_children = self.max_keys + 1
+        self.keys_format = struct.Struct(f'>{self.max_keys}Q') #Keys (and values)
+        self.children_format = struct.Struct(f'>{self.max_children}Q') #Children
+        self.keys_offset = NODE_HEAD_FORMAT.size #Offsets of the fields inside a node block
+        self.values_offset = self.keys_offset + self.keys_format.size
+        self.children_offset = self.values_offset + self.keys_format.size
+    key_format = KEYS_FIXED
+    #New node, and node read from a block
+    def new_node(self, block_id, is_root=False):
+        return BTreeNode(block_id, is_root=is_root, layout=self)
+    def read_node(self, data):
+        return BTreeNode.from_bytes(data, self)
+    #When the tree splits, borrows and merges: a node holds at most 2*degree - 1 keys, and at least degree - 1
+    #unless it is the root. The upper degree keys of an overflowing node move out and the one before them moves up
+    def overflows(self, node):
+        return node.num_keys > self.max_keys
+    def split_index(self, node):
+        return self.degree - 1
+    def underflows(self, node):
+        return node.num_keys < self.degree - 1
+    #Whether lender can give its key at index to a sibling, the parent's key at sep moving down in exchange
+    def can_lend(self, lender, index, parent, sep):
+        return lender.num_keys >= self.degree
+    #Whether left, the parent's key at sep and right fit in one node
+    def can_merge(self, left, parent, sep, right):
+        return True
+    #Fraction of the node's key slots in use
+    def fill(self, node):
+        return node.num_keys / self.max_keys
+    #Checks a pair before it is inserted
+    def check_pair(self, key, value):
+        if not (0 <= key < 2**64 and 0 <= value < 2**64): #Keys and values are stored as unsigned 64-bit integers
+            raise ValueError(f"key-value pair {key},{value} does not fit in 64 bits.")
+    #Key or value from the text of a command, and back
+    def parse(self, text):
+        number = int(text)
+        if not 0 <= number < 2**64:
+            raise ValueError(f"{number} does not fit in 64 bits.")
+        return number
+    def text(self, item):
+        return str(item)
+    #Import/export: EXTRACT formats, binary records and the pairs of a CSV or binary file
+    def encoders(self):
+        return EXPORT_FORMATS
+    def pack_pair(self, key, value):
+        return PAIR_FORMAT.pack(key, value)
+    def read_binary(self, f):
+        return read_binary_pairs(f)
+    def read_pairs(self, input_file):
+        return read_pairs(input_file)
+    #Empty batch of keys or values
+    def new_batch(self):
+        return array('Q')
+
+DEFAULT_LAYOUT = NodeLayout() #Layout of files without a block size in the header
 
 #B-TREE NODE CLASS
+#A node keeps a copy of the block it was read from and only decodes the keys, values and children the first time
+#they are used (a search usually never touches the values of the nodes it passes through). The decoded fields are
+#array('Q') with one spare slot so a node can overflow before it is split, and to_bytes packs them back into the
+#same block buffer
 class BTreeNode:
+    __slots__ = ('block_id', 'parent_id', 'is_root', 'num_keys', 'layout', '_block', '_keys', '_values', '_children')
     #Constructor
-    def __init__(self, block_id, is_root=False): 
+    def __init__(self, block_id, is_root=False, layout=DEFAULT_LAYOUT): 
+        self.layout = layout #Block size and degree of the file the node belongs to
         self.block_id = block_id
         self.parent_id = 0  
         self.is_root = is_root
         self.num_keys = 0
-        self.keys = [0] * MAX_KEYS 
-        self.values = [0] * MAX_KEYS
-        self.children = [0] * MAX_CHILDREN
-    #Converts the node to bytes
+        self._block = None #Raw block the node was read from (None for a new node)
+        self._keys = None #Decoded on first use
+        self._values = None
+        self._children = None
+    #Decodes `count` big-endian integers starting at offset, plus the spare overflow slot
+    def _decode(self, offset, count):
+        field = array('Q')
+        if self._block is None: #New node: all zeros
+            field.frombytes(bytes(8 * (count + 1)))
+            return field
+        field.frombytes(memoryview(self._block)[offset:offset + 8 * count]) #Copy the raw integers in one go
+        if NATIVE_LITTLE_ENDIAN: #The file stores big-endian integers
+            field.byteswap()
+        field.append(0) #Spare overflow slot
+        return field
+    #Keys, values and children are decoded on demand and changed in place (they keep the spare overflow slot)
+    @property
+    def keys(self):
+        if self._keys is None:
+            self._keys = self._decode(self.layout.keys_offset, self.layout.max_keys)
+        return self._keys
+    @property
+    def values(self):
+        if self._values is None:
+            self._values = self._decode(self.layout.values_offset, self.layout.max_keys)
+        return self._values
+    @property
+    def children(self):
+        if self._children is None:
+            self._children = self._decode(self.layout.children_offset, self.layout.max_children)
+        return self._children
+    #A leaf has no first child. Reads only that one pointer if the children are not decoded yet
+    @property
+    def is_leaf(self):
+        if self._children is None and self._block is not None:
+            return CHILD_FORMAT.unpack_from(self._block, self.layout.children_offset)[0] == 0
+        return self.children[0] == 0
+    #Converts the node to bytes: the fields are packed into the node's block buffer, which is reused across calls.
+    #Fields that were never decoded are still valid in the buffer and are left as they are
     def to_bytes(self): 
-        data = struct.pack('>Q', self.block_id) #Block ID
-        data += struct.pack('>Q', self.parent_id) #Parent ID
-        data += struct.pack('>Q', self.num_keys) #Number of keys
-        data += struct.pack(f'>{MAX_KEYS}Q', *self.keys) #Keys 
-        data += struct.pack(f'>{MAX_KEYS}Q', *self.values) #Values
-        data += struct.pack(f'>{MAX_CHILDREN}Q', *self.children) #Children
-        return data + blank_block()[len(data):] 
+        layout = self.layout
+        block = self._block
+        if block is None: #New node: start from a blank block
+            block = self._block = bytearray(layout.block_size)
+        NODE_HEAD_FORMAT.pack_into(block, 0, self.block_id, self.parent_id, self.num_keys) #Block ID, Parent ID, Number of keys
+        if self._keys is not None:
+            layout.keys_format.pack_into(block, layout.keys_offset, *self._keys[:layout.max_keys]) #Keys
+        if self._values is not None:
+            layout.keys_format.pack_into(block, layout.values_offset, *self._values[:layout.max_keys]) #Values
+        if self._children is not None:
+            layout.children_format.pack_into(block, layout.children_offset, *self._children[:layout.max_children]) #Children
+        return block
     @staticmethod 
-    #Converts bytes to node
-    def from_bytes(data):
-        block_id, parent_id, num_keys = struct.unpack('>QQQ', data[:24]) #Block ID, Parent ID, Number of keys
-        keys = list(struct.unpack(f'>{MAX_KEYS}Q', data[24:24 + 8 * MAX_KEYS])) #Keys
-        values = list(struct.unpack(f'>{MAX_KEYS}Q', data[24 + 8 * MAX_KEYS:24 + 16 * MAX_KEYS])) #Values
-        children = list(struct.unpack(f'>{MAX_CHILDREN}Q', data[24 + 16 * MAX_KEYS:24 + 16 * MAX_KEYS + 8 * MAX_CHILDREN])) #Children
-        node = BTreeNode(block_id) #Create a new node
-        node.parent_id = parent_id #Set the parent ID
-        node.num_keys = num_keys #Set the number of keys
-        node.keys = keys #Set the keys
-        node.values = values #Set the values
-        node.children = children #Set the children
+    #Converts bytes to node: only the block ID, parent ID and number of keys are decoded here
+    def from_bytes(data, layout=DEFAULT_LAYOUT):
+        node = BTreeNode(0, layout=layout) #Create a new node
+        node._block = bytearray(data) #Own copy of the block (data may be a view of a mapped file)
+        node.block_id, node.parent_id, node.num_keys = NODE_HEAD_FORMAT.unpack_from(node._block, 0) #Block ID, Parent ID, Number of keys
         return node #Return the node
 
+#SLOTTED PAGE LAYOUT
+#Nodes of files whose keys and values are byte strings. A node block starts with the block ID, parent ID, number
+#of keys and first child (PAGE_HEAD_FORMAT), then a slot directory with the offset of every cell in key order,
+#and the cells are packed from the end of the block towards it:
+#  cell = CELL_HEAD_FORMAT, the rest of the key, the value (or the first overflow page of a long value), right child
+#Keys are prefix compressed: a key only stores what follows the prefix it shares with the key before it. Values
+#longer than max_inline bytes live in a chain of overflow pages, so a cell never takes more than about an eighth
+#of the block. Nodes hold as many keys as fit, so splits, borrowing and merging go by bytes instead of counts
+class SlottedLayout:
+    key_format = KEYS_BYTES
+    #Constructor: raises ValueError if the block size is not usable
+    def __init__(self, block_size=BLOCK_SIZE):
+        if block_size < MIN_BLOCK_SIZE or block_size > MAX_SLOTTED_BLOCK_SIZE or block_size & (block_size - 1):
+            raise ValueError(f"block size {block_size} must be a power of two between {MIN_BLOCK_SIZE} and {MAX_SLOTTED_BLOCK_SIZE} for byte keys.")
+        self.block_size = block_size
+        self.degree = 0 #No fixed degree
+        self.max_inline = (block_size - PAGE_HEAD_FORMAT.size) // 16 #Longest key, and longest value kept in its cell
+        self.min_size = block_size // 3 #Nodes other than the root smaller than this borrow from or merge with a sibling
+        self.overflow_size = block_size - NODE_HEAD_FORMAT.size #Bytes of a long value in each of its overflow pages
+    def new_node(self, block_id, is_root=False):
+        return SlottedNode(block_id, is_root=is_root, layout=self)
+    def read_node(self, data):
+        return SlottedNode.from_bytes(data, self)
+    #A node is split when its cells no longer fit in the block, at the key where the cells before it reach half
+    #of the node (never the first or last key, so both halves keep a key)
+    def overflows(self, node):
+        return node.size() > self.block_size
+    def split_index(self, node):
+        keys, values, internal = node.keys, node.values, not node.is_leaf
+        half = (node.size() - PAGE_HEAD_FORMAT.size) // 2
+        used = 0
+        previous = b''
+        for i in range(node.num_keys):
+            used += cell_size(previous, keys[i], values[i], internal)
+            previous = keys[i]
+            if used >= half:
+                break
+        return max(1, min(i, node.num_keys - 2))
+    def underflows(self, node):
+        return node.size() < self.min_size
+    #The lender must stay at least min_size and the parent must still fit with the lent key as its separator
+    def can_lend(self, lender, index, parent, sep):
+        count = lender.num_keys
+        if count < 2:
+            return False
+        keys, values = lender.keys[:count], lender.values[:count]
+        key, value = keys.pop(index), values.pop(index)
+        if slotted_size(keys, values, not lender.is_leaf) < self.min_size:
+            return False
+        count = parent.num_keys
+        keys, values = parent.keys[:count], parent.values[:count]
+        keys[sep], values[sep] = key, value
+        return slotted_size(keys, values, True) <= self.block_size
+    def can_merge(self, left, parent, sep, right):
+        keys = left.keys[:left.num_keys] + [parent.keys[sep]] + right.keys[:right.num_keys]
+        values = left.values[:left.num_keys] + [parent.values[sep]] + right.values[:right.num_keys]
+        return slotted_size(keys, values, not left.is_leaf) <= self.block_size
+    #Fraction of the block in use
+    def fill(self, node):
+        return node.size() / self.block_size
+    def check_pair(self, key, value):
+        if not isinstance(key, bytes) or not isinstance(value, bytes):
+            raise ValueError("keys and values must be byte strings.")
+        if len(key) > self.max_inline:
+            raise ValueError(f"keys can be at most {self.max_inline} bytes long with {self.block_size} byte blocks.")
+        if len(value) >= 2**32:
+            raise ValueError("values must be shorter than 4 GiB.")
+    #Text is stored as its UTF-8 bytes (bytes that are not UTF-8 round-trip through surrogate escapes)
+    def parse(self, text):
+        return text.encode('utf-8', 'surrogateescape')
+    def text(self, item):
+        return item.decode('utf-8', 'surrogateescape')
+    def encoders(self):
+        return BYTES_EXPORT_FORMATS
+    def pack_pair(self, key, value):
+        return BYTE_PAIR_FORMAT.pack(len(key), len(value)) + key + value
+    def read_binary(self, f):
+        return read_byte_pairs(f)
+    def read_pairs(self, input_file): #Checks every pair, as read_pairs does for integers
+        for key, value in read_byte_pairs_file(input_file):
+            self.check_pair(key, value)
+            yield key, value
+    def new_batch(self):
+        return []
+    #Overflow pages of a long value: how many it needs, and each page (block ID, block) for the block IDs given
+    def overflow_count(self, value):
+        return -(-len(value) // self.overflow_size)
+    def overflow_blocks(self, value, pages):
+        for n, block_id in enumerate(pages):
+            block = bytearray(self.block_size)
+            NODE_HEAD_FORMAT.pack_into(block, 0, block_id, pages[n + 1] if n + 1 < len(pages) else 0, OVERFLOW_BLOCK)
+            chunk = value[n * self.overflow_size:(n + 1) * self.overflow_size]
+            block[NODE_HEAD_FORMAT.size:NODE_HEAD_FORMAT.size + len(chunk)] = chunk
+            yield block_id, block
+
+#Value kept in overflow pages: the node only holds its first page and its length
+class OverflowRef:
+    __slots__ = ('block_id', 'length')
+    #Constructor
+    def __init__(self, block_id, length):
+        self.block_id = block_id
+        self.length = length
+
+#List of node fields of a slotted page. Setting the item just past the end appends it, the same way the tree code
+#fills the spare slot of a fixed size node
+class NodeList(list):
+    __slots__ = ()
+    def __setitem__(self, index, item):
+        if index.__class__ is int and index == len(self):
+            self.append(item)
+        else:
+            list.__setitem__(self, index, item)
+
+#Length of the prefix two byte strings share (binary search over slice comparisons, which run in C)
+def shared_prefix(a, b):
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+#Bytes a key-value pair takes in a slotted page after the key before it: its slot and its cell
+def cell_size(previous, key, value, internal):
+    size = SLOT_FORMAT.size + CELL_HEAD_FORMAT.size + len(key) - shared_prefix(previous, key)
+    size += CHILD_FORMAT.size if value.__class__ is OverflowRef else len(value)
+    return size + CHILD_FORMAT.size if internal else size
+
+#Bytes a slotted page of these keys and values takes
+def slotted_size(keys, values, internal):
+    size = PAGE_HEAD_FORMAT.size
+    previous = b''
+    for key, value in zip(keys, values):
+        size += cell_size(previous, key, value, internal)
+        previous = key
+    return size
+
+#SLOTTED NODE CLASS
+#Node of a file with byte string keys. Like BTreeNode it keeps the block it was read from and decodes the keys
+#(with the children) and the values on first use, into lists the tree code works on the same way as on arrays
+class SlottedNode:
+    __slots__ = ('block_id', 'parent_id', 'is_root', 'num_keys', 'layout', '_block', '_keys', '_values', '_children')
+    #Constructor
+    def __init__(self, block_id, is_root=False, layout=None):
+        self.layout = layout
+        self.block_id = block_id
+        self.parent_id = 0
+        self.is_root = is_root
+        self.num_keys = 0
+        self._block = None #Raw block the node was read from (None for a new node)
+        self._keys = None if layout is None else NodeList() #A new node starts as an empty leaf
+        self._values = None if layout is None else NodeList()
+        self._children = None if layout is None else NodeList([0])
+    #Offsets of the cells of the block (the block's own key count: the node may have changed since it was read)
+    def _slots(self):
+        count = NODE_HEAD_FORMAT.unpack_from(self._block, 0)[2]
+        start = PAGE_HEAD_FORMAT.size
+        return [offset for (offset,) in SLOT_FORMAT.iter_unpack(self._block[start:start + SLOT_FORMAT.size * count])]
+    #Rebuilds the keys from their shared prefix lengths and suffixes, and the children from the cells
+    def _decode_keys(self):
+        block = self._block
+        first_child = PAGE_HEAD_FORMAT.unpack_from(block, 0)[3]
+        max_inline = self.layout.max_inline
+        keys = NodeList()
+        children = NodeList([first_child])
+        key = b''
+        for offset in self._slots():
+            shared, suffix, length = CELL_HEAD_FORMAT.unpack_from(block, offset)
+            start = offset + CELL_HEAD_FORMAT.size
+            key = key[:shared] + block[start:start + suffix]
+            keys.append(key)
+            if first_child: #Internal node: the right child follows the value
+                end = start + suffix + (CHILD_FORMAT.size if length > max_inline else length)
+                children.append(CHILD_FORMAT.unpack_from(block, end)[0])
+        self._keys = keys
+        self._children = children
+    def _decode_values(self):
+        block = self._block
+        max_inline = self.layout.max_inline
+        values = NodeList()
+        for offset in self._slots():
+            _, suffix, length = CELL_HEAD_FORMAT.unpack_from(block, offset)
+            start = offset + CELL_HEAD_FORMAT.size + suffix
+            if length > max_inline: #Long value: first overflow page
+                values.append(OverflowRef(CHILD_FORMAT.unpack_from(block, start)[0], length))
+            else:
+                values.append(block[start:start + length])
+        self._values = values
+    @property
+    def keys(self):
+        if self._keys is None:
+            self._decode_keys()
+        return self._keys
+    @keys.setter
+    def keys(self, keys):
+        self._keys = NodeList(keys)
+    @property
+    def values(self):
+        if self._values is None:
+            self._decode_values()
+        return self._values
+    @values.setter
+    def values(self, values):
+        self._values = NodeList(values)
+    @property
+    def children(self):
+        if self._children is None:
+            self._decode_keys()
+        return self._children
+    @children.setter
+    def children(self, children):
+        self._children = NodeList(children)
+    @property
+    def is_leaf(self):
+        if self._children is None:
+            return PAGE_HEAD_FORMAT.unpack_from(self._block, 0)[3] == 0
+        return self._children[0] == 0
+    #Bytes the node takes as a slotted page (more than the block size when it has to be split)
+    def size(self):
+        count = self.num_keys
+        return slotted_size(self.keys[:count], self.values[:count], not self.is_leaf)
+    #Converts the node to a slotted page
+    def to_bytes(self):
+        layout = self.layout
+        internal = not self.is_leaf
+        keys, values, children = self.keys, self.values, self.children
+        block = bytearray(layout.block_size)
+        PAGE_HEAD_FORMAT.pack_into(block, 0, self.block_id, self.parent_id, self.num_keys, children[0] if internal else 0)
+        slot = PAGE_HEAD_FORMAT.size #Next slot
+        end = layout.block_size #Start of the last cell written
+        previous = b''
+        for i in range(self.num_keys):
+            key, value = keys[i], values[i]
+            shared = shared_prefix(previous, key)
+            previous = key
+            if value.__class__ is OverflowRef:
+                cell = CELL_HEAD_FORMAT.pack(shared, len(key) - shared, value.length) + key[shared:] + CHILD_FORMAT.pack(value.block_id)
+            else:
+                cell = CELL_HEAD_FORMAT.pack(shared, len(key) - shared, len(value)) + key[shared:] + value
+            if internal:
+                cell += CHILD_FORMAT.pack(children[i + 1])
+            end -= len(cell)
+            if end < slot + SLOT_FORMAT.size: #The tree splits nodes before they are written, so this is a bug
+                raise ValueError(f"node {self.block_id} does not fit in a block.")
+            block[end:end + len(cell)] = cell
+            SLOT_FORMAT.pack_into(block, slot, end)
+            slot += SLOT_FORMAT.size
+        return block
+    @staticmethod
+    #Converts a slotted page to a node: only the head is decoded here
+    def from_bytes(data, layout):
+        node = SlottedNode(0)
+        node.layout = layout
+        node._block = bytes(data) #Own copy of the block (data may be a view of a mapped file)
+        node.block_id, node.parent_id, node.num_keys = NODE_HEAD_FORMAT.unpack_from(node._block, 0)
+        return node
+
 #B-TREE HEADER CLASS 
 class BTreeHeader:
     #Constructor
-    def __init__(self): 
+    def __init__(self, block_size=BLOCK_SIZE, degree=DEGREE, key_format=KEYS_FIXED): 
         self.magic_number = MAGIC_NUMBER #Magic number
         self.root_id = 0 #Root ID
         self.next_block_id = 1 #Next block ID
+        self.block_size = block_size #Size of every block in the file, the header included
+        self.degree = degree #Degree of every node in the file
+        self.free_head = 0 #First block of the free block list (0 when it is empty)
+        self.free_count = 0 #Number of blocks on the free block list
+        self.key_format = key_format #KEYS_FIXED or KEYS_BYTES
+    #Node layout described by the header
+    def layout(self):
+        if self.key_format == KEYS_BYTES:
+            return SlottedLayout(self.block_size)
+        return NodeLayout(self.block_size, self.degree)
     #Converts the header to bytes
     def to_bytes(self): 
         data = self.magic_number #Magic number
         data += struct.pack('>Q', self.root_id) #Root ID
         data += struct.pack('>Q', self.next_block_id) #Next block ID
-        return data + blank_block()[len(data):] #Return the data
+        data += struct.pack('>Q', self.block_size) #Block size
+        data += struct.pack('>Q', self.degree) #Degree
+        data += struct.pack('>Q', self.free_head) #First free block
+        data += struct.pack('>Q', self.free_count) #Number of free blocks
+        data += struct.pack('>Q', self.key_format) #Key format
+        return data + blank_block(self.block_size)[len(data):] #Return the data
     @staticmethod 
     #Converts bytes to header
     def from_bytes(data):
         magic_number = data[:8]  #Magic number
         if magic_number != MAGIC_NUMBER: #Check if the magic number is valid
             raise ValueError("Invalid magic number in file header.")
-        root_id, next_block_id = struct.unpack('>QQ', data[8:24]) #Root ID, Next block ID
-        header = BTreeHeader() #Create a new header
+        root_id, next_block_id, block_size, degree, free_head, free_count, key_format = struct.unpack('>QQQQQQQ', data[8:64]) #Root ID, Next block ID, Block size, Degree, Free list, Key format
+        if block_size == 0 and degree == 0: #Files from before the block size was stored use 512 byte blocks and degree 10
+            block_size, degree = BLOCK_SIZE, DEGREE
+        if key_format not in KEY_FORMATS.values(): #Files from before the key format was stored have integer keys (0)
+            raise ValueError(f"unknown key format {key_format}.")
+        if next_block_id < 1 or root_id >= next_block_id or free_head >= next_block_id or free_count >= next_block_id: #Block 0 is the header and the root must be allocated
+            raise ValueError("Invalid block IDs in file header.")
+        header = BTreeHeader(block_size, degree, key_format) #Create a new header
+        header.layout() #Check that the block size and degree describe a usable node layout
         header.root_id = root_id #Set the root ID
         header.next_block_id = next_block_id #Set the next block ID
+        header.free_head = free_head #Set the free block list
+        header.free_count = free_count
         return header #Return the header
     
 
+#STORAGE CLASSES
+#Block level access to the index file. FileStorage reads every block with seek + read
+class FileStorage:
+    #Constructor
+    def __init__(self, file, block_size=BLOCK_SIZE):
+        self.file = file
+        self.block_size = block_size
+        self.reads = 0 #Blocks read from the file
+        self.writes = 0 #Blocks written to the file
+    #Returns the bytes of a block
+    def read_block(self, block_id):
+        self.reads += 1
+        self.file.seek(block_id * self.block_size) #Seek to the position of the block in the file
+        return self.file.read(self.block_size) #Read the block data from the file
+    #Writes one or more consecutive blocks starting at block_id
+    def write_blocks(self, block_id, data):
+        self.writes += len(data) // self.block_size
+        self.file.seek(block_id * self.block_size) #Seek to the position of the block in the file
+        self.file.write(data) #Write the blocks to the file
+    #Flushes buffered writes to the operating system
+    def flush(self):
+        self.file.flush()
+    #Storage the bulk load writes to
+    def unlogged(self):
+        return self
+    #No extra counters
+    def stats(self):
+        return {}
+    #Closes the file
+    def close(self):
+        self.file.close()
+
+#PreadStorage reads and writes with os.pread/os.pwrite, which never move the file position, so any number of
+#threads can read blocks at the same time (POSIX only)
+class PreadStorage(FileStorage):
+    #Returns the bytes of a block
+    def read_block(self, block_id):
+        self.reads += 1
+        return os.pread(self.file.fileno(), self.block_size, block_id * self.block_size)
+    #Writes one or more consecutive blocks starting at block_id
+    def write_blocks(self, block_id, data):
+        self.writes += len(data) // self.block_size
+        position = block_id * self.block_size
+        data = memoryview(data)
+        while data: #pwrite may write less than asked for
+            written = os.pwrite(self.file.fileno(), data, position)
+            data = data[written:]
+            position += written
+
+#MmapStorage maps the index file and hands out memoryview slices of the mapping, so a cache miss decodes the node
+#straight from the page cache without a read call or a copy. Writes still go through the file; the mapping is
+#remapped when a read goes past its end because the file grew
+class MmapStorage(FileStorage):
+    #Constructor
+    def __init__(self, file, block_size=BLOCK_SIZE):
+        super().__init__(file, block_size)
+        self.map = None #The mapping of the file
+        self.view = None #memoryview over the mapping
+        self.pending = False #True when writes may still sit in the file's buffer
+        self.lock = threading.Lock() #Serializes flushing and remapping between reader threads
+        self._remap()
+    #Maps the whole file again (called when the file has grown past the mapping). The old mapping is not closed
+    #here: another thread may still be decoding a block from it, it goes away with its last view
+    def _remap(self):
+        self.file.flush() #The mapping only sees what has reached the operating system
+        self.pending = False
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) #Map the whole file read-only
+        self.view = memoryview(self.map)
+    #Releases the mapping
+    def _unmap(self):
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+    #Returns a memoryview of a block inside the mapping (valid until the next write)
+    def read_block(self, block_id):
+        self.reads += 1
+        block_size = self.block_size
+        start = block_id * block_size
+        view = self.view
+        if self.pending or start + block_size > len(view): #Buffered writes to push out or the file grew
+            with self.lock:
+                if self.pending: #Push buffered writes to the operating system so the mapping sees them
+                    self.file.flush()
+                    self.pending = False
+                if start + block_size > len(self.view): #The file grew since it was mapped
+                    self._remap()
+                view = self.view
+            if start + block_size > len(view):
+                raise ValueError(f"block {block_id} is past the end of the file.")
+        return view[start:start + block_size]
+    #Writes go through the file; the mapping sees them once they are flushed
+    def write_blocks(self, block_id, data):
+        super().write_blocks(block_id, data)
+        self.pending = True
+    #Flushes the file
+    def flush(self):
+        super().flush()
+        self.pending = False
+    #Unmaps and closes the file
+    def close(self):
+        self._unmap()
+        super().close()
+
+STORAGE_MODES = {'file': FileStorage, 'pread': PreadStorage, 'mmap': MmapStorage} #Storage modes accepted by BTree.open_file
+
+#WRITE-AHEAD LOG CLASS
+#Redo log kept next to the index file. While it is on, every block written is appended to the log as a page
+#record instead of going to the index file, and each finished operation appends a commit record. Commits are
+#grouped: the log is only written and fsynced when group_size commits are waiting or the oldest waiting commit is
+#commit_interval seconds old, so one fsync covers many inserts (a crash loses at most the last group, never half
+#an operation). The age of the group is checked when the next commit arrives and whenever sync_due is called, so
+#a program that may stop writing for a while calls sync_due on a timer (the query server does). Once
+#checkpoint_blocks distinct blocks are logged they are copied into the index file and the log starts over.
+#Records are a WAL_RECORD_FORMAT head followed by the page for page records
+class WriteAheadLog:
+    #Constructor
+    def __init__(self, path, block_size, group_size=WAL_GROUP_SIZE, commit_interval=WAL_COMMIT_INTERVAL,
+                 checkpoint_blocks=WAL_CHECKPOINT_BLOCKS):
+        self.path = path
+        self.block_size = block_size
+        self.group_size = max(1, group_size)
+        self.commit_interval = commit_interval
+        self.checkpoint_blocks = max(1, checkpoint_blocks)
+        self.file = open(path, 'ab') #The log is only ever appended to (or truncated by a checkpoint)
+        self.buffer = bytearray() #Records not written to the log file yet
+        self.pages = {} #Block ID -> latest page logged since the last checkpoint
+        self.waiting = 0 #Commits in the buffer that are not durable yet
+        self.first_wait = None #When the oldest of them was made
+        self.synced = 0 #Number of the last commit made durable
+        self.commits = 0 #Counters for STATS
+        self.syncs = 0
+        self.pages_logged = 0
+        self.checkpoints = 0
+    #CRC-32 of a record head (without the CRC) and its page
+    @staticmethod
+    def _checksum(kind, ident, page=b''):
+        return zlib.crc32(page, zlib.crc32(kind + ident.to_bytes(8, 'big')))
+    #Appends a page record
+    def log_page(self, block_id, data):
+        page = bytes(data) #Own copy: the caller may reuse its buffer
+        self.pages[block_id] = page
+        self.buffer += WAL_RECORD_FORMAT.pack(b'P', block_id, self._checksum(b'P', block_id, page))
+        self.buffer += page
+        self.pages_logged += 1
+        if len(self.buffer) >= BULK_WRITE_SIZE: #Large groups go to the log file early (without an fsync)
+            self.file.write(self.buffer)
+            self.buffer.clear()
+    #Appends a commit record. The group is made durable when it is full, when its oldest commit has waited
+    #commit_interval seconds, or when force is set. Returns True if the log was synced
+    def commit(self, force=False):
+        self.commits += 1
+        self.buffer += WAL_RECORD_FORMAT.pack(b'C', self.commits, self._checksum(b'C', self.commits))
+        self.waiting += 1
+        now = time.monotonic()
+        if self.first_wait is None:
+            self.first_wait = now
+        if force or self.waiting >= self.group_size or now - self.first_wait >= self.commit_interval:
+            self.sync()
+            return True
+        return False
+    #Makes the waiting group durable if its oldest commit has waited commit_interval seconds. Returns True if
+    #the log was synced
+    def sync_due(self):
+        if self.waiting and time.monotonic() - self.first_wait >= self.commit_interval:
+            self.sync()
+            return True
+        return False
+    #Writes the buffered records and fsyncs the log
+    def sync(self):
+        self.file.write(self.buffer)
+        self.buffer.clear()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.waiting = 0
+        self.first_wait = None
+        self.synced = self.commits
+        self.syncs += 1
+    #Copies every logged page into the index file, makes it durable and empties the log.
+    #Only called right after a sync, when every logged page belongs to a committed operation
+    def checkpoint(self, storage):
+        for block_id in sorted(self.pages): #Block order keeps the writes as sequential as possible
+            storage.write_blocks(block_id, self.pages[block_id])
+        storage.flush()
+        os.fsync(storage.file.fileno())
+        self.file.truncate(0) #The index file now holds everything the log did
+        os.fsync(self.file.fileno())
+        self.pages.clear()
+        self.checkpoints += 1
+    #Closes the log file
+    def close(self):
+        self.file.close()
+    #Replays the log at path into storage: the pages of every operation whose commit record made it to disk are
+    #written to the index file, anything after the last complete commit is dropped. Returns the number of blocks
+    #recovered and empties the log
+    @staticmethod
+    def replay(path, storage):
+        with open(path, 'rb') as f:
+            data = f.read()
+        block_size = storage.block_size
+        committed = {} #Block ID -> page of committed operations
+        pending = {} #Pages after the last commit record
+        position = 0
+        while position + WAL_RECORD_FORMAT.size <= len(data):
+            kind, ident, checksum = WAL_RECORD_FORMAT.unpack_from(data, position)
+            position += WAL_RECORD_FORMAT.size
+            if kind == b'P': #Page record
+                page = data[position:position + block_size]
+                if len(page) < block_size or WriteAheadLog._checksum(kind, ident, page) != checksum: #Torn write
+                    break
+                pending[ident] = page
+                position += block_size
+            elif kind == b'C' and WriteAheadLog._checksum(kind, ident) == checksum: #Commit record
+                committed.update(pending)
+                pending.clear()
+            else: #Garbage left by a crash
+                break
+        for block_id in sorted(committed):
+            storage.write_blocks(block_id, committed[block_id])
+        storage.flush()
+        os.fsync(storage.file.fileno())
+        with open(path, 'wb') as f: #Empty the log
+            os.fsync(f.fileno())
+        return len(committed)
+
+#Storage used while the write-ahead log is on: writes become page records in the log, reads of logged blocks
+#are answered from the log's pages, everything else is read from the index file
+class WalStorage:
+    #Constructor
+    def __init__(self, base, wal):
+        self.base = base #Storage of the index file
+        self.wal = wal
+        self.block_size = base.block_size
+    @property
+    def reads(self):
+        return self.base.reads
+    @property
+    def writes(self):
+        return self.base.writes
+    #Returns the latest version of a block
+    def read_block(self, block_id):
+        page = self.wal.pages.get(block_id)
+        if page is not None:
+            return page
+        return self.base.read_block(block_id)
+    #Logs one or more consecutive blocks
+    def write_blocks(self, block_id, data):
+        block_size = self.block_size
+        for offset in range(0, len(data), block_size):
+            self.wal.log_page(block_id + offset // block_size, memoryview(data)[offset:offset + block_size])
+    #Pages reach the disk through commit, nothing to flush
+    def flush(self):
+        pass
+    #Ends an operation, checkpointing when enough blocks are logged
+    def commit(self, force=False):
+        if self.wal.commit(force):
+            self._after_sync()
+    #Syncs the waiting group once it is due
+    def sync_due(self):
+        if self.wal.sync_due():
+            self._after_sync()
+    def _after_sync(self):
+        if len(self.wal.pages) >= self.wal.checkpoint_blocks:
+            self.wal.checkpoint(self.base)
+    #Makes everything logged durable and copies it into the index file
+    def checkpoint(self):
+        if self.wal.waiting or self.wal.buffer:
+            self.wal.sync()
+        self.wal.checkpoint(self.base)
+    #Storage that bypasses the log (used by the bulk load, which only writes blocks no committed state points to)
+    def unlogged(self):
+        self.checkpoint()
+        return self.base
+    #Log counters for STATS
+    def stats(self):
+        return {'wal_commits': self.wal.commits, 'wal_syncs': self.wal.syncs,
+                'wal_pages_logged': self.wal.pages_logged, 'wal_checkpoints': self.wal.checkpoints}
+    #Checkpoints and closes the log and the index file
+    def close(self):
+        self.checkpoint()
+        self.wal.close()
+        self.base.close()
+
+
+#BUFFER POOL CLASS
+#LRU pool of nodes with dirty tracking: modified nodes stay in memory and are only written back when they are
+#evicted or the pool is flushed. Pinned nodes (the active root-to-leaf path) are never evicted; while everything
+#is pinned the pool grows past its capacity and shrinks back when the nodes are unpinned
+class BufferPool:
+    #Constructor: write_back is called with a node whenever a dirty node has to go to disk
+    def __init__(self, write_back, capacity_blocks=None, capacity_bytes=None):
+        if capacity_blocks is None and capacity_bytes is None: #Default to the original 3 node limit
+            capacity_blocks = DEFAULT_CACHE_BLOCKS
+        if capacity_blocks is not None and capacity_bytes is not None:
+            raise ValueError("give the cache capacity in blocks or in bytes, not both.")
+        self.write_back = write_back
+        self.capacity_blocks = capacity_blocks
+        self.capacity_bytes = capacity_bytes
+        self.block_size = BLOCK_SIZE
+        self.frames = OrderedDict() #Block ID -> node, least recently used first
+        self.dirty = set() #Block IDs of nodes changed since they were last written
+        self.pins = {} #Block ID -> pin count
+        self.hits = 0 #Lookups answered from memory
+        self.misses = 0 #Lookups that had to read the file
+        self.evictions = 0 #Nodes dropped from memory
+        self.writebacks = 0 #Dirty nodes written to the file
+    #Number of nodes the pool holds before it starts evicting
+    @property
+    def capacity(self):
+        if self.capacity_bytes is not None:
+            return max(1, self.capacity_bytes // self.block_size) #Bytes are rounded down to whole blocks
+        return max(1, self.capacity_blocks)
+    #Returns the cached node (and marks it most recently used) or None
+    def get(self, block_id):
+        node = self.frames.get(block_id)
+        if node is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.frames.move_to_end(block_id) #Most recently used
+        return node
+    #Adds or replaces a node in the pool
+    def put(self, node, dirty=False):
+        self.frames[node.block_id] = node
+        self.frames.move_to_end(node.block_id)
+        if dirty:
+            self.dirty.add(node.block_id)
+        self._evict()
+    #Keeps a node in memory until it is unpinned
+    def pin(self, block_id):
+        self.pins[block_id] = self.pins.get(block_id, 0) + 1
+    #Releases a pin and evicts again if the pool grew past its capacity while nodes were pinned
+    def unpin(self, block_id):
+        count = self.pins.get(block_id, 0) - 1
+        if count > 0:
+            self.pins[block_id] = count
+        else:
+            self.pins.pop(block_id, None)
+        self._evict()
+    #Evicts least recently used unpinned nodes until the pool fits its capacity
+    def _evict(self):
+        if len(self.frames) <= self.capacity:
+            return
+        for block_id in list(self.frames):
+            if len(self.frames) <= self.capacity:
+                break
+            if block_id in self.pins: #Pinned nodes stay
+                continue
+            node = self.frames.pop(block_id)
+            if block_id in self.dirty: #Write back before dropping it
+                self.dirty.discard(block_id)
+                self.write_back(node)
+                self.writebacks += 1
+            self.evictions += 1
+    #Writes every dirty node back to the file, in block order so the writes are sequential
+    def flush(self):
+        for block_id in sorted(self.dirty):
+            self.write_back(self.frames[block_id])
+            self.writebacks += 1
+        self.dirty.clear()
+    #Drops one node without writing it (its block was freed)
+    def discard(self, block_id):
+        self.frames.pop(block_id, None)
+        self.dirty.discard(block_id)
+        self.pins.pop(block_id, None)
+    #Drops every node without writing anything (only safe after a flush)
+    def clear(self):
+        self.frames.clear()
+        self.dirty.clear()
+        self.pins.clear()
+    #Counters for the STATS command
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'capacity': self.capacity,
+            'cached': len(self.frames),
+            'dirty': len(self.dirty),
+            'pinned': len(self.pins),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'writebacks': self.writebacks,
+        }
+
+
+#Buffer pool that can be shared by threads: every operation on the pool holds its latch. Block reads on a miss
+#happen outside the latch, so threads missing on different blocks read them in parallel
+class LatchedBufferPool(BufferPool):
+    #Constructor
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latch = threading.Lock()
+    def get(self, block_id):
+        with self.latch:
+            return super().get(block_id)
+    def put(self, node, dirty=False):
+        with self.latch:
+            super().put(node, dirty)
+    def pin(self, block_id):
+        with self.latch:
+            super().pin(block_id)
+    def unpin(self, block_id):
+        with self.latch:
+            super().unpin(block_id)
+    def flush(self):
+        with self.latch:
+            super().flush()
+    def discard(self, block_id):
+        with self.latch:
+            super().discard(block_id)
+    def clear(self):
+        with self.latch:
+            super().clear()
+    def stats(self):
+        with self.latch:
+            return super().stats()
+
+#READ-WRITE LOCK CLASS
+#Many readers or one writer. Waiting writers go first so a steady stream of readers cannot starve them. Both
+#sides are reentrant for the thread holding them (a writer may also read), but a reader cannot become a writer
+class ReadWriteLock:
+    #Constructor
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0 #Threads holding the read lock
+        self.writer = None #Thread holding the write lock
+        self.writers_waiting = 0
+        self.local = threading.local() #Read lock depth of each thread
+    #Holds the read lock for the body of a with statement
+    @contextmanager
+    def reading(self):
+        depth = getattr(self.local, 'depth', 0)
+        if depth or self.writer == threading.get_ident(): #Already holds the lock
+            self.local.depth = depth + 1
+            try:
+                yield
+            finally:
+                self.local.depth = depth
+            return
+        with self.condition:
+            while self.writer is not None or self.writers_waiting:
+                self.condition.wait()
+            self.readers += 1
+        self.local.depth = 1
+        try:
+            yield
+        finally:
+            self.local.depth = 0
+            with self.condition:
+                self.readers -= 1
+                if not self.readers:
+                    self.condition.notify_all()
+    #Holds the write lock for the body of a with statement
+    @contextmanager
+    def writing(self):
+        me = threading.get_ident()
+        if self.writer == me: #Already the writer
+            yield
+            return
+        with self.condition:
+            self.writers_waiting += 1
+            while self.writer is not None or self.readers:
+                self.condition.wait()
+            self.writers_waiting -= 1
+            self.writer = me
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writer = None
+                self.condition.notify_all()
+
+#Decorators for the BTree methods that read or change the tree: they hold the tree's read or write lock when the
+#tree was made with concurrent=True
+def reads_tree(method):
+    @wraps(method)
+    def locked(self, *args, **kwargs):
+        with self._reading():
+            return method(self, *args, **kwargs)
+    return locked
+def writes_tree(method):
+    @wraps(method)
+    def locked(self, *args, **kwargs):
+        with self._writing():
+            return method(self, *args, **kwargs)
+    return locked
+
+
 #B-TREE CLASS
 class BTree: 
-    #Constructor
-    def __init__(self, file_name):
+    #Constructor: the node cache holds cache_blocks nodes, or as many nodes as fit in cache_bytes.
+    #With wal=True every insert is committed to a write-ahead log (see WriteAheadLog for the other options).
+    #With concurrent=True the tree can be shared by threads: searches and scans run in parallel under a read lock
+    #(blocks are read with pread or from the mapping, never through the shared file position), inserts and loads
+    #take the write lock
+    def __init__(self, file_name, cache_blocks=None, cache_bytes=None, wal=False, group_size=WAL_GROUP_SIZE,
+                 commit_interval=WAL_COMMIT_INTERVAL, checkpoint_blocks=WAL_CHECKPOINT_BLOCKS, concurrent=False):
         self.file_name = file_name
+        self.wal_options = (group_size, commit_interval, checkpoint_blocks) if wal else None # None when the log is off
+        self.header_dirty = False # True when the header changed since it was last written
         self.header = BTreeHeader()  # Initialize the header
+        self.layout = DEFAULT_LAYOUT  # Node layout of the open file (block size and degree)
         self.file = None
-        self.cache = OrderedDict()  # Cache for nodes
-        self.cache_limit = 3  # Limit the cache size 
+        self.storage = None # Block level access to the file (see STORAGE_MODES)
+        self.storage_mode = 'file' # Storage mode the file was opened with
+        self.lock = ReadWriteLock() if concurrent else None  # Readers/writer lock in concurrent mode
+        pool_class = LatchedBufferPool if concurrent else BufferPool
+        self.pool = pool_class(self._write_node, cache_blocks, cache_bytes)  # Buffer pool for nodes
     
+    #Read and write lock contexts (nothing to hold when the tree is not shared by threads)
+    def _reading(self):
+        return self.lock.reading() if self.lock else nullcontext()
+    def _writing(self):
+        return self.lock.writing() if self.lock else nullcontext()
+
     #FILE REALTED FUNCTIONS
-    #Opens the file
-    def open_file(self, mode='rb+'): 
+    #Opens the file. storage is 'file' (seek + read per block), 'pread' (positional reads) or 'mmap' (nodes are
+    #decoded from a mapping of the file). A concurrent tree uses 'pread' instead of 'file'
+    def open_file(self, mode='rb+', storage='file'): 
+        if storage not in STORAGE_MODES: #Check the storage mode
+            raise ValueError(f"unknown storage mode '{storage}'. use one of: {', '.join(STORAGE_MODES)}.")
+        if self.lock and storage == 'file': #Threads must not share the file position
+            storage = 'pread'
         if not os.path.exists(self.file_name):#Check if the file exists
             raise FileNotFoundError(f"file '{self.file_name}' does not exist.") #Raise an error if the file does not exist
         self.file = open(self.file_name, mode) #Open the file
-        header_data = self.file.read(BLOCK_SIZE) #Read the header
+        self._read_header()
+        wal_path = self.file_name + WAL_SUFFIX
+        if os.path.exists(wal_path) and os.path.getsize(wal_path) > 0: #A write-ahead log was not checkpointed
+            if not self.file.writable():
+                self.file.close()
+                self.file = None
+                raise ValueError(f"file '{self.file_name}' has a write-ahead log to recover. open it for writing first.")
+            recovered = WriteAheadLog.replay(wal_path, FileStorage(self.file, self.layout.block_size)) #Redo committed operations
+            print(f"Recovered {recovered} blocks from the write-ahead log.")
+            self._read_header() #The header may have been replayed too
+        self.storage_mode = storage # Reused when COMPACT reopens the file
+        self.storage = STORAGE_MODES[storage](self.file, self.layout.block_size) #Set up block access to the file
+        if self.wal_options and self.file.writable(): #Log every write from now on
+            self.storage = WalStorage(self.storage, WriteAheadLog(wal_path, self.layout.block_size, *self.wal_options))
+    #Reads and checks the header of the open file
+    def _read_header(self):
+        self.file.seek(0)
+        header_data = self.file.read(MIN_BLOCK_SIZE) #Read the header (its fields fit in the smallest block size)
         try: # Try to read the header
             self.header = BTreeHeader.from_bytes(header_data) 
-        except ValueError: #Raise an error if the header is invalid
-            raise ValueError(f"file '{self.file_name}' has an invalid format.")
-    #Creates a new file
-    def create_file(self):
-        if os.path.exists(self.file_name):  # Check if the file already exists
+        except (ValueError, struct.error) as e: #Raise an error if the header is invalid
+            self.file.close()
+            self.file = None
+            raise ValueError(f"file '{self.file_name}' has an invalid format ({e})")
+        self._use_layout(self.header.layout())
+    #Switches the tree (and the buffer pool's size in blocks) to a node layout
+    def _use_layout(self, layout):
+        self.layout = layout
+        self.pool.block_size = layout.block_size
+    #Creates a new file. block_size is the size of every block (a power of two, e.g. 4096 to match the filesystem
+    #page) and degree defaults to the largest degree whose nodes fit in a block. key_format KEYS_BYTES makes a file
+    #of byte string keys and values in slotted pages (it has no degree). An existing file is replaced if overwrite
+    #is True; False raises FileExistsError and None asks the user
+    def create_file(self, block_size=BLOCK_SIZE, degree=None, overwrite=None, key_format=KEYS_FIXED):
+        if key_format == KEYS_BYTES:
+            if degree is not None:
+                raise ValueError("files with byte keys have no degree.")
+            degree = 0
+        elif degree is None:
+            degree = max_degree(block_size)
+        header = BTreeHeader(block_size, degree, key_format)
+        layout = header.layout() #Raises ValueError for an unusable block size or degree
+        if os.path.exists(self.file_name) and not overwrite:  # Check if the file already exists
+            if overwrite is False:
+                raise FileExistsError(f"file '{self.file_name}' exists.")
             overwrite = input(f"File '{self.file_name}' exists. Overwrite? (yes/no): ").strip().lower()
             if overwrite != 'yes':
                 return
+        self.header = header  # Record the block size, degree and key format in the header
+        self._use_layout(layout)
         self.file = open(self.file_name, 'wb+')  # Open the file in write mode
-        self.file.write(self.header.to_bytes())  # Write the header to the file
+        self.storage_mode = 'pread' if self.lock else 'file'  # Threads must not share the file position
+        self.storage = STORAGE_MODES[self.storage_mode](self.file, block_size)  # Block access to the file
+        self.storage.write_blocks(0, self.header.to_bytes())  # Write the header to the file
+        wal_path = self.file_name + WAL_SUFFIX
+        if os.path.exists(wal_path): # A log left by an overwritten file must not be replayed into this one
+            os.remove(wal_path)
+        if self.wal_options: # Log every write from now on
+            self.storage.flush()
+            os.fsync(self.file.fileno())
+            self.storage = WalStorage(self.storage, WriteAheadLog(wal_path, block_size, *self.wal_options))
         print(f"Created new file '{self.file_name}'.")
-    #Closes the file
+    #Closes the file after writing back every dirty node
+    @writes_tree
     def close_file(self):
         if self.file: #Check if the file is open
-            self.file.close() #Close the file
+            if self.file.writable(): #Files opened read-only have nothing to write back
+                self.flush() #Write back the buffer pool
+            self.storage.close() #Close the file
+            self.file = None
+            self.storage = None
+    #Writes every dirty node and the header to the file (with the log on: commits them and syncs the log)
+    @writes_tree
+    def flush(self):
+        if not self.file: #Check if the file is open
+            raise ValueError("file is not open.")
+        self.pool.flush() #Write back the dirty nodes
+        self.save_header() #Save the header (this also flushes the file)
+        if isinstance(self.storage, WalStorage):
+            self.storage.commit(force=True)
+    #Ends an operation. With the log on, the dirty nodes and header go to the log and a commit record is added
+    #(made durable with its group); without it, they stay in the buffer pool until write-back
+    def _commit(self):
+        if isinstance(self.storage, WalStorage):
+            self.pool.flush()
+            if self.header_dirty:
+                self.save_header()
+            self.storage.commit()
+    #With the log on: makes the waiting commits durable once the oldest has waited commit_interval seconds.
+    #The interval is otherwise only checked when the next commit arrives
+    @writes_tree
+    def sync_due(self):
+        if isinstance(self.storage, WalStorage):
+            self.storage.sync_due()
     #Save the header to the file: by writing it to the beginning of the file and flushing the file
     def save_header(self): 
         if not self.file: #Check if the file is open 
             raise ValueError("file is not open.")
-        self.file.seek(0) #Seek to the beginning of the file
-        self.file.write(self.header.to_bytes()) #Write the header to the file
-        self.file.flush() #Flush the file which writes the data to the disk and clears the buffer
+        self.storage.write_blocks(0, self.header.to_bytes()) #Write the header to the beginning of the file
+        self.storage.flush() #Flush the file which writes the data to the disk and clears the buffer
+        self.header_dirty = False
     #Check if the file is open
     def is_file_open(self):  
         if not self.file: #Check if the file is open
@@ -124,126 +1151,432 @@ class BTree:
             return False #Return False if the file is not open
         return True #Return True if the file is open
     
-    #LRU CACE MANAGEMNET FUNCTIONS 
-    #Load a node from the file 
-    def load_node(self, block_id: int) -> BTreeNode: 
-        if block_id in self.cache: #Check if the node is in the cache
-            node = self.cache.pop(block_id) #Pop the node from the cache
-            self.cache[block_id] = node #Add the node to the end of the cache
-            return node #Return the node
-        #Read the node from the file
-        if not self.file: #Check if the file is open
-            raise ValueError("file is not open.") #Raise an error if the file is not open
-        position = block_id * BLOCK_SIZE #Calculate the position of the block in the file
-        self.file.seek(position) #Seek to the position of the block in the file
-        block_data = self.file.read(BLOCK_SIZE) #Read the block data from the file
-        node = BTreeNode.from_bytes(block_data) #Create a new node from the block data
-        # Add to cache
-        if len(self.cache) >= self.cache_limit: #Check if the cache is full
-            evicted_block_id, _ = self.cache.popitem(last=False) #Evict the least recently used node from the cache
-            print(f"evicted node with block ID {evicted_block_id} from memory.") 
-        self.cache[block_id] = node #Add the node to the cache
+    #BUFFER POOL FUNCTIONS 
+    #Load a node from the buffer pool or the file. A pinned node stays in memory until unpin_node is called
+    def load_node(self, block_id: int, pin=False) -> BTreeNode: 
+        node = self.pool.get(block_id) #Check if the node is in the buffer pool
+        if node is None: #Read the node from the file
+            if not self.file: #Check if the file is open
+                raise ValueError("file is not open.") #Raise an error if the file is not open
+            block_data = self.storage.read_block(block_id) #Read the block data from the file
+            node = self.layout.read_node(block_data) #Create a new node from the block data
+            if pin: #Pin before adding so the node cannot be evicted right away
+                self.pool.pin(block_id)
+            self.pool.put(node) #Add the node to the buffer pool
+        elif pin:
+            self.pool.pin(block_id)
         return node #Return the node
-    #Save a node to the file
+    #Release a node pinned by load_node
+    def unpin_node(self, node: BTreeNode):
+        self.pool.unpin(node.block_id)
+    #Save a node: the node is marked dirty in the buffer pool and written back later
     def save_node(self, node: BTreeNode):
         if not self.file: #`Check if the file is open`
             raise ValueError("file is not open.")
-        position = node.block_id * BLOCK_SIZE #Calculate the position of the block in the file
-        self.file.seek(position) #Seek to the position of the block in the file
-        self.file.write(node.to_bytes()) #Write the node to the file
-        # Update the cache
-        if node.block_id in self.cache: #Check if the node is in the cache
-            self.cache.pop(node.block_id)  # Remove old entry
-        elif len(self.cache) >= self.cache_limit: #Check if the cache is full
-            evicted_block_id, _ = self.cache.popitem(last=False) #Evict the least recently used node from the cache
-            print(f"evicted node with block ID {evicted_block_id} from memory.")
-        self.cache[node.block_id] = node #Add the node to the cache
+        self.pool.put(node, dirty=True) #Add the node to the buffer pool as dirty
+    #Write a node to its block in the file (called by the buffer pool on write-back)
+    def _write_node(self, node: BTreeNode):
+        self.storage.write_blocks(node.block_id, node.to_bytes()) #Write the node to its block in the file
+    #Buffer pool counters plus the blocks read from and written to the file
+    def cache_stats(self):
+        stats = self.pool.stats()
+        stats['blocks_read'] = self.storage.reads if self.storage else 0
+        stats['blocks_written'] = self.storage.writes if self.storage else 0
+        if self.storage:
+            stats.update(self.storage.stats()) #Write-ahead log counters
+        return stats
+    #Shape of the tree: height (levels), nodes, keys, fill factor (average share of a node in use: its key slots, or
+    #its bytes for byte keys; for the leaves alone too)
+    #and the blocks used by the file. Reads every node, level by level
+    @reads_tree
+    def tree_stats(self):
+        stats = {'height': 0, 'nodes': 0, 'keys': 0, 'leaves': 0, 'leaf_keys': 0, 'fill_factor': 0.0, 'leaf_fill_factor': 0.0,
+                 'file_blocks': self.header.next_block_id, 'free_blocks': self.header.free_count}
+        if not self.file or self.header.root_id == 0: #Nothing to measure
+            return stats
+        fill = leaf_fill = 0.0 #Sums of the fill of every node (layout.fill)
+        level = [self.header.root_id]
+        while level:
+            stats['height'] += 1
+            next_level = [] #Children of this level, in key order
+            for block_id in level:
+                node = self.load_node(block_id)
+                stats['nodes'] += 1
+                stats['keys'] += node.num_keys
+                fill += self.layout.fill(node)
+                if node.is_leaf:
+                    stats['leaves'] += 1
+                    stats['leaf_keys'] += node.num_keys
+                    leaf_fill += self.layout.fill(node)
+                else:
+                    next_level.extend(node.children[:node.num_keys + 1])
+            level = next_level
+        stats['fill_factor'] = fill / stats['nodes']
+        stats['leaf_fill_factor'] = leaf_fill / stats['leaves']
+        return stats
     #Allocate a new node in the file
     def allocate_node(self, is_root=False) -> BTreeNode:
-        block_id = self.header.next_block_id #Get the next block ID
-        self.header.next_block_id += 1 #Increment the next block ID
-        self.save_header() #Save the header to the file
-        return BTreeNode(block_id, is_root=is_root) #Return a new node with the allocated block ID
+        return self.layout.new_node(self._allocate_block(), is_root=is_root) #Return a new node with the allocated block ID
+    #Allocate a block, reusing one from the free list when there is one
+    def _allocate_block(self):
+        if self.header.free_head: #Take the first free block
+            block_id = self.header.free_head
+            _, next_free, marker = NODE_HEAD_FORMAT.unpack_from(self.storage.read_block(block_id), 0)
+            if marker != FREE_BLOCK: #The free list must only hold free blocks
+                raise ValueError(f"block {block_id} on the free list is not free.")
+            self.header.free_head = next_free
+            self.header.free_count -= 1
+        else:
+            block_id = self.header.next_block_id #Get the next block ID
+            self.header.next_block_id += 1 #Increment the next block ID
+        self.header_dirty = True #The header is written with the next flush or commit
+        return block_id
+    
+    #Put a node's block on the free list. The block is written right away as a free block holding the ID of the
+    #next free block; the node is dropped from the buffer pool so it is never written back over that
+    def free_node(self, node: BTreeNode):
+        self.pool.discard(node.block_id)
+        self._free_block(node.block_id)
+    def _free_block(self, block_id):
+        block = bytearray(self.layout.block_size)
+        NODE_HEAD_FORMAT.pack_into(block, 0, block_id, self.header.free_head, FREE_BLOCK)
+        self.storage.write_blocks(block_id, block)
+        self.header.free_head = block_id
+        self.header.free_count += 1
+        self.header_dirty = True
+
+    #OVERFLOW PAGES
+    #Values of byte key files longer than the layout's max_inline are written to a chain of overflow pages when
+    #they are inserted, and the node keeps an OverflowRef. Every page starts like a node (block ID, next page,
+    #OVERFLOW_BLOCK) and the pages are written straight to storage like free blocks. Returns what the node stores
+    def _store_value(self, value):
+        layout = self.layout
+        if layout.key_format == KEYS_FIXED or len(value) <= layout.max_inline:
+            return value
+        pages = [self._allocate_block() for _ in range(layout.overflow_count(value))]
+        for block_id, block in layout.overflow_blocks(value, pages):
+            self.storage.write_blocks(block_id, block)
+        return OverflowRef(pages[0], len(value))
+    #The block IDs of the overflow pages of a value
+    def _overflow_pages(self, ref):
+        block_id = ref.block_id
+        while block_id:
+            data = self.storage.read_block(block_id)
+            _, next_page, marker = NODE_HEAD_FORMAT.unpack_from(data, 0)
+            if marker != OVERFLOW_BLOCK: #A chain must only hold overflow pages
+                raise ValueError(f"block {block_id} is not an overflow page.")
+            yield block_id, data
+            block_id = next_page
+    #The value a node stores, with a long value read back from its overflow pages
+    def _load_value(self, value):
+        if value.__class__ is not OverflowRef:
+            return value
+        data = b''.join(bytes(block[NODE_HEAD_FORMAT.size:]) for _, block in self._overflow_pages(value))
+        return data[:value.length]
+    #The values of a run of pairs, with long values read back
+    def _load_values(self, values):
+        if self.layout.key_format == KEYS_FIXED: #Nothing to read
+            return values
+        return [self._load_value(value) for value in values]
+    #Frees the overflow pages of a value that left the tree
+    def _drop_value(self, value):
+        if value.__class__ is OverflowRef:
+            for block_id in [block_id for block_id, _ in self._overflow_pages(value)]:
+                self._free_block(block_id)
     
     #COMMANDS 
     
     #INSERT COMMAND
     #Insert a key-value pair into the B-Tree 
+    @writes_tree
     def insert(self, key, value): 
         if not self.is_file_open(): #Check if the file is open
             print("No file is open. Use 'CREATE' or 'OPEN' first.")
             return
-        if self.search(key, show_error=False) is not None: #Check if the key already exists in the B-Tree
+        new_root = self.header.root_id == 0 # Empty tree
+        if not self._insert(key, value): # The descent found the key already in the B-Tree
             print(f"Key {key} already exists. Duplicate keys are not allowed.")
             return
-        # Insert key-value pair
+        self._commit() # End of the operation (written to the log when it is on)
+        if new_root:
+            print(f"Inserted key {key} into a new root.") 
+        else:
+            print(f"Inserted key {key}.") # Print a message if the key is inserted successfully
+    #Insert a key-value pair without any messages. Returns False if the key already exists.
+    #The descent is iterative and records the path, so overflowing nodes are split on the way back up
+    #from the nodes already in memory (they stay pinned until the insert is done)
+    def _insert(self, key, value):
+        self.layout.check_pair(key, value) # Raises ValueError for a pair the file cannot store
         if self.header.root_id == 0:  # Empty tree
             root = self.allocate_node(is_root=True) # Allocate a new root node
             root.keys[0] = key # Set the key
-            root.values[0] = value # Set the value
+            root.values[0] = self._store_value(value) # Set the value (long values go to overflow pages)
             root.num_keys = 1 # Set the number of keys
             self.header.root_id = root.block_id # Set the root ID
-            self.save_header() # Save the header to the file
+            self.header_dirty = True # The header is written with the next flush or commit
             self.save_node(root) # Save the root node to the file
-            print(f"Inserted key {key} into a new root.") 
-        else: # Non-empty tree
-            root = self.load_node(self.header.root_id) # Load the root node
-            if self._insert_non_full(root, key, value):  # Check if root overflowed
+            return True
+        path = [] # (node, child index) for every internal node on the way down
+        node = self.load_node(self.header.root_id, pin=True) # Load and pin the root node
+        try:
+            while True: # Descend to the leaf the key belongs in
+                keys = node.keys
+                i = bisect_left(keys, key, 0, node.num_keys) # Binary search over the live keys
+                if i < node.num_keys and keys[i] == key: # Duplicate keys are not allowed
+                    return False
+                if node.is_leaf:
+                    break
+                path.append((node, i))
+                node = self.load_node(node.children[i], pin=True) # Load and pin the child
+            # Insert into the leaf, shifting the larger keys and values one slot to the right
+            count = node.num_keys
+            node.keys[i + 1:count + 1] = node.keys[i:count]
+            node.values[i + 1:count + 1] = node.values[i:count]
+            node.keys[i] = key
+            node.values[i] = self._store_value(value)
+            node.num_keys += 1
+            self.save_node(node)  # Mark the leaf dirty in the buffer pool
+            self._split_up(node, path) # Split overflowing nodes on the way back up
+            return True
+        finally:
+            self.unpin_node(node) # Every node on the path can be evicted again
+            for parent, _ in path:
+                self.unpin_node(parent)
+    # Split a node while it overflows, moving up the recorded path of (ancestor, child index) pairs from the nodes
+    # already in memory. When the root overflows the tree grows by one level
+    def _split_up(self, node, path):
+        level = len(path)
+        while self.layout.overflows(node):
+            if level:
+                level -= 1
+                parent, i = path[level]
+                self._split_child(parent, i, node) # Split the child into the parent
+                self.save_node(parent) # Save parent node changes
+                node = parent
+            else: # The root overflowed: the tree grows by one level
                 new_root = self.allocate_node(is_root=True) # Allocate a new root node
-                new_root.children[0] = root.block_id # Set the old root as the first child
-                self._split_child(new_root, 0, root) # Split the old root
+                new_root.children[0] = node.block_id # Set the old root as the first child
+                self._split_child(new_root, 0, node) # Split the old root
                 self.header.root_id = new_root.block_id # Set the new root ID
-                self.save_header() # Save the header to the file
+                self.header_dirty = True # The header is written with the next flush or commit
                 self.save_node(new_root) # Save the new root node to the file
-            print(f"Inserted key {key}.") # Print a message if the key is inserted successfully
-    #Insert a key-value pair into a non-full node
-    def _insert_non_full(self, node, key, value): 
-        i = node.num_keys - 1 # Get the index of the last key
-        if node.children[0] == 0:  # Leaf node
-            # Insert key into the correct position
-            while i >= 0 and key < node.keys[i]: # Find the correct position to insert the key
-                node.keys[i + 1] = node.keys[i] # Shift keys to the right
-                node.values[i + 1] = node.values[i] # Shift values to the right
-                i -= 1 # Move to the previous key
-            node.keys[i + 1] = key 
-            node.values[i + 1] = value 
-            node.num_keys += 1 
-            self.save_node(node)  # Save changes to file and cache
-            return node.num_keys > MAX_KEYS # Check if the node is full
-        else: # Internal node
-            while i >= 0 and key < node.keys[i]: # Find the correct child to insert the key
-                i -= 1 # Move to the previous key
-            i += 1 # Move to the correct child
-            child = self.load_node(node.children[i])  # Load child node
-            if self._insert_non_full(child, key, value): # Recursively insert into child
-                self._split_child(node, i, child) # Split child if it overflows
-            self.save_node(node)  # Save parent node changes
-            return node.num_keys > MAX_KEYS # Check if the node is full
-    # Function to split a child node
+                node = new_root
+    # Function to split an overflowing child node: the keys after the middle one move to a new node and the middle
+    # key moves up (the layout picks the middle: key degree - 1, or the middle by bytes for byte keys)
     def _split_child(self, parent, index, child): 
+        middle = self.layout.split_index(child)
         new_node = self.allocate_node() # Allocate a new node
-        new_node.num_keys = DEGREE - 1
-        for j in range(DEGREE - 1): # Copy keys and values to new node
-            new_node.keys[j] = child.keys[j + DEGREE]
-            new_node.values[j] = child.values[j + DEGREE]
-        if child.children[0] != 0: # Copy children if not a leaf node
-            for j in range(DEGREE): # Copy children to new node
-                new_node.children[j] = child.children[j + DEGREE]
-        child.num_keys = DEGREE - 1 # Update child node
-        for j in range(parent.num_keys, index, -1): # Shift children to the right
-            parent.children[j + 1] = parent.children[j]
+        start = middle + 1 # First key that moves over
+        count = child.num_keys - start
+        new_node.num_keys = count
+        new_node.keys[:count] = child.keys[start:start + count] # Copy keys and values to new node
+        new_node.values[:count] = child.values[start:start + count]
+        if not child.is_leaf: # Copy children if not a leaf node
+            new_node.children[:count + 1] = child.children[start:start + count + 1]
+            child.children[start:start + count + 1] = array('Q', bytes(8 * (count + 1))) # Clear the moved child pointers
+        child.num_keys = middle # Update child node
+        count = parent.num_keys
+        parent.children[index + 2:count + 2] = parent.children[index + 1:count + 1] # Shift children to the right
         parent.children[index + 1] = new_node.block_id # Set new node as child
-        for j in range(parent.num_keys - 1, index - 1, -1): # Shift keys and values to the right
-            parent.keys[j + 1] = parent.keys[j]
-            parent.values[j + 1] = parent.values[j]
-        parent.keys[index] = child.keys[DEGREE - 1] 
-        parent.values[index] = child.values[DEGREE - 1] 
+        parent.keys[index + 1:count + 1] = parent.keys[index:count] # Shift keys and values to the right
+        parent.values[index + 1:count + 1] = parent.values[index:count]
+        parent.keys[index] = child.keys[middle] 
+        parent.values[index] = child.values[middle] 
         parent.num_keys += 1
         self.save_node(child)
         self.save_node(new_node)
     
+    #DELETE COMMAND
+    #Delete a key from the B-Tree
+    @writes_tree
+    def delete(self, key):
+        if not self.is_file_open(): #Check if the file is open
+            print("No file is open. Use 'CREATE' or 'OPEN' first.")
+            return
+        if not self._delete(key):
+            print(f"Error: Key {key} not found.")
+            return
+        self._commit() # End of the operation (written to the log when it is on)
+        print(f"Deleted key {key}.")
+    #Delete a key without any messages. Returns False if the key is not in the tree.
+    #A key in an internal node is replaced by its predecessor (the largest key of its left subtree), so a key is
+    #always removed from a leaf. Nodes left too small (fewer than degree - 1 keys) are fixed on the way back up the
+    #recorded path by borrowing a key from a sibling or merging with it, and an emptied root is freed
+    def _delete(self, key):
+        if self.header.root_id == 0: # Empty tree
+            return False
+        pinned = [] # Every node loaded for this delete, unpinned when it is done
+        path = [] # (node, child index) for every internal node on the way down
+        node = self.load_node(self.header.root_id, pin=True) # Load and pin the root node
+        pinned.append(node)
+        try:
+            while True: # Descend to the node holding the key
+                i = bisect_left(node.keys, key, 0, node.num_keys) # Binary search over the live keys
+                if i < node.num_keys and node.keys[i] == key:
+                    break
+                if node.is_leaf: # Not in the tree
+                    return False
+                path.append((node, i))
+                node = self.load_node(node.children[i], pin=True)
+                pinned.append(node)
+            removed = node.values[i] # Its overflow pages (if any) are freed once the key is out of the tree
+            target = None # Internal node whose key was replaced by its predecessor
+            if not node.is_leaf: # Replace the key by its predecessor and delete that from its leaf instead
+                target, index = node, i
+                path.append((node, i))
+                node = self.load_node(node.children[i], pin=True)
+                pinned.append(node)
+                while not node.is_leaf: # Rightmost path of the left subtree
+                    path.append((node, node.num_keys))
+                    node = self.load_node(node.children[node.num_keys], pin=True)
+                    pinned.append(node)
+                i = node.num_keys - 1
+                target.keys[index] = node.keys[i]
+                target.values[index] = node.values[i]
+                self.save_node(target)
+            count = node.num_keys # Remove key i from the leaf, shifting the larger keys one slot to the left
+            node.keys[i:count - 1] = node.keys[i + 1:count]
+            node.values[i:count - 1] = node.values[i + 1:count]
+            node.num_keys -= 1
+            self.save_node(node)
+            while path and self.layout.underflows(node): # Fix underflowing nodes on the way back up
+                parent, i = path.pop()
+                self._rebalance(parent, i, node, pinned)
+                node = parent
+            root = pinned[0]
+            if root.num_keys == 0: # The root lost its last key: the tree shrinks by one level (or becomes empty)
+                self.header.root_id = 0 if root.is_leaf else root.children[0]
+                self.header_dirty = True
+                self.free_node(root)
+            if target is not None and self.layout.overflows(target): # Byte keys: a longer predecessor can overflow it
+                self._split_path(target, pinned)
+            self._drop_value(removed)
+            return True
+        finally:
+            for pinned_node in pinned:
+                self.unpin_node(pinned_node)
+    #Split a node that overflowed outside of an insert, after finding the path to it again from the root
+    def _split_path(self, node, pinned):
+        path = []
+        current = self.load_node(self.header.root_id, pin=True)
+        pinned.append(current)
+        while current is not node: # The node holds its first key, so the descent for it ends there
+            i = bisect_left(current.keys, node.keys[0], 0, current.num_keys)
+            path.append((current, i))
+            current = self.load_node(current.children[i], pin=True)
+            pinned.append(current)
+        self._split_up(node, path)
+    #Fix child i of parent after it became too small: borrow a key through the parent from a sibling that has one
+    #to spare, otherwise merge the child with a sibling and the key between them. With byte keys a node can stay
+    #small when neither is possible (the parent has no room for a longer separator and the merge would not fit)
+    def _rebalance(self, parent, i, child, pinned):
+        layout = self.layout
+        if i > 0: # Try the left sibling
+            left = self.load_node(parent.children[i - 1], pin=True)
+            pinned.append(left)
+            if layout.can_lend(left, left.num_keys - 1, parent, i - 1): # Rotate right: the parent's key moves down, the left sibling's last key moves up
+                count = child.num_keys
+                child.keys[1:count + 1] = child.keys[0:count]
+                child.values[1:count + 1] = child.values[0:count]
+                if not child.is_leaf:
+                    child.children[1:count + 2] = child.children[0:count + 1]
+                    child.children[0] = left.children[left.num_keys]
+                    left.children[left.num_keys] = 0
+                child.keys[0] = parent.keys[i - 1]
+                child.values[0] = parent.values[i - 1]
+                child.num_keys = count + 1
+                left.num_keys -= 1
+                parent.keys[i - 1] = left.keys[left.num_keys]
+                parent.values[i - 1] = left.values[left.num_keys]
+                self.save_node(left)
+                self.save_node(child)
+                self.save_node(parent)
+                return
+        if i < parent.num_keys: # Try the right sibling
+            right = self.load_node(parent.children[i + 1], pin=True)
+            pinned.append(right)
+            if layout.can_lend(right, 0, parent, i): # Rotate left: the parent's key moves down, the right sibling's first key moves up
+                count = child.num_keys
+                child.keys[count] = parent.keys[i]
+                child.values[count] = parent.values[i]
+                if not child.is_leaf:
+                    child.children[count + 1] = right.children[0]
+                child.num_keys = count + 1
+                parent.keys[i] = right.keys[0]
+                parent.values[i] = right.values[0]
+                count = right.num_keys
+                right.keys[0:count - 1] = right.keys[1:count]
+                right.values[0:count - 1] = right.values[1:count]
+                if not right.is_leaf:
+                    right.children[0:count] = right.children[1:count + 1]
+                    right.children[count] = 0
+                right.num_keys = count - 1
+                self.save_node(right)
+                self.save_node(child)
+                self.save_node(parent)
+                return
+        if i > 0 and layout.can_merge(left, parent, i - 1, child): # Neither sibling can lend: merge with one of them
+            self._merge(parent, i - 1, left, child)
+        elif i < parent.num_keys and layout.can_merge(child, parent, i, right):
+            self._merge(parent, i, child, right)
+    #Merge right into left together with the parent's key at index sep between them, then free right
+    def _merge(self, parent, sep, left, right):
+        count = left.num_keys
+        right_count = right.num_keys
+        left.keys[count] = parent.keys[sep] # The separator moves down
+        left.values[count] = parent.values[sep]
+        left.keys[count + 1:count + 1 + right_count] = right.keys[0:right_count]
+        left.values[count + 1:count + 1 + right_count] = right.values[0:right_count]
+        if not left.is_leaf:
+            left.children[count + 1:count + 2 + right_count] = right.children[0:right_count + 1]
+        left.num_keys = count + 1 + right_count
+        count = parent.num_keys # Remove the separator and the pointer to right from the parent
+        parent.keys[sep:count - 1] = parent.keys[sep + 1:count]
+        parent.values[sep:count - 1] = parent.values[sep + 1:count]
+        parent.children[sep + 1:count] = parent.children[sep + 2:count + 1]
+        parent.children[count] = 0
+        parent.num_keys = count - 1
+        self.save_node(left)
+        self.save_node(parent)
+        self.free_node(right)
+
+    #COMPACT COMMAND
+    #Rewrite the tree into a new file packed like a bulk load: the leaves in key order on contiguous blocks, then
+    #each internal level, with no free blocks. The new file replaces the old one and stays open in the same mode
+    @writes_tree
+    def compact(self):
+        if not self.is_file_open(): #Check if the file is open
+            return
+        old_blocks = self.header.next_block_id
+        self.flush() #Everything the tree holds reaches the file (or the log)
+        run = tempfile.TemporaryFile() #Every pair in key order, written as binary records
+        count = 0
+        encode = self.layout.encoders()['bin']
+        for keys, values in self._walk():
+            run.write(encode(keys, self._load_values(values)))
+            count += len(keys)
+        run.seek(0)
+        header = BTreeHeader(self.header.block_size, self.header.degree, self.header.key_format) #Same block size, degree and key format
+        temp_name = self.file_name + '.compact'
+        with open(temp_name, 'wb+') as f:
+            storage = FileStorage(f, header.block_size)
+            if count:
+                header.root_id, header.next_block_id = self._build_tree(self.layout.read_binary(run), count, storage, 1)
+            storage.write_blocks(0, header.to_bytes())
+            storage.flush()
+            os.fsync(f.fileno()) #The new file is durable before it replaces the old one
+        run.close()
+        self.storage.close() #Checkpoints the log (if any) into the old file, which is replaced next
+        self.file = None
+        self.storage = None
+        self.pool.clear()
+        os.replace(temp_name, self.file_name)
+        self.open_file(storage=self.storage_mode)
+        print(f"Compacted '{self.file_name}' from {old_blocks} to {self.header.next_block_id} blocks.")
+
     # SEARCH COMMAND
     # Search for a key in the B-Tree
+    @reads_tree
     def search(self, key, show_error=True): 
         if not self.is_file_open():  # Check if the file is open
             if show_error:
@@ -253,7 +1586,7 @@ class BTree:
             if show_error:
                 print("The B-Tree is empty.")
             return None
-        value = self._search_recursive(self.load_node(self.header.root_id), key)  # Recursively search for the key
+        value = self._search(key)  # Walk down from the root
         if value is not None:
             if show_error:
                 print(f"Key: {key}, Value: {value}")  # Print the key-value pair if found
@@ -262,19 +1595,135 @@ class BTree:
                 print(f"Error: Key {key} not found.")  # Print an error message if the key is not found
         return value
 
-    # Recursive search function
-    def _search_recursive(self, node, key):
-        i = 0
-        while i < node.num_keys and key > node.keys[i]:  # Find the correct key position
-            i += 1
-        if i < node.num_keys and key == node.keys[i]:  # Check if the key is found
-            return node.values[i]
-        if node.children[0] == 0:  # Check if the node is a leaf node
-            return None
-        return self._search_recursive(self.load_node(node.children[i]), key)  # Recursively search for the key
+    # Iterative search: binary search inside each node, then descend into the child the key belongs in
+    def _search(self, key):
+        node = self.load_node(self.header.root_id)
+        while True:
+            keys = node.keys
+            i = bisect_left(keys, key, 0, node.num_keys)  # Find the correct key position
+            if i < node.num_keys and keys[i] == key:  # Check if the key is found
+                value = node.values[i]
+                return value if value.__class__ is not OverflowRef else self._load_value(value)
+            if node.is_leaf:  # Check if the node is a leaf node
+                return None
+            node = self.load_node(node.children[i])  # Descend into the child
+
+    #Search for many keys in one walk of the tree. Returns a dict with the value of every key (None if not found).
+    #The keys are sorted and walked down together: each node hands every child only the keys that fall in that
+    #child's range, so a node shared by several keys is read once per batch instead of once per key
+    @reads_tree
+    def search_many(self, keys):
+        results = dict.fromkeys(keys) #Every key starts as not found
+        if not self.file or self.header.root_id == 0: #Nothing to search
+            return results
+        pending = sorted(results) #The batch in key order
+        stack = [(self.header.root_id, 0, len(pending))] #(block ID, first key, end of keys) still to visit
+        while stack:
+            block_id, start, end = stack.pop()
+            node = self.load_node(block_id)
+            node_keys = node.keys
+            count = node.num_keys
+            leaf = node.is_leaf
+            visits = [] #Children to visit, in key order
+            j = start
+            while j < end:
+                key = pending[j]
+                i = bisect_left(node_keys, key, 0, count) #Binary search inside the node
+                if i < count and node_keys[i] == key: #Found in this node
+                    results[key] = self._load_value(node.values[i])
+                    j += 1
+                elif leaf: #Not in the tree
+                    j += 1
+                else: #Every key of the batch below node_keys[i] belongs to child i
+                    k = bisect_left(pending, node_keys[i], j, end) if i < count else end
+                    visits.append((node.children[i], j, k))
+                    j = k
+            stack.extend(reversed(visits)) #Children are visited left to right
+        return results
+
+    #Search for every key listed in a file (one key per line, anything after a comma is ignored so a LOAD file
+    #works too) and print the results in the order of the file. Returns False if the keys could not be read
+    def search_batch(self, input_file):
+        if not self.is_file_open(): #Check if the file is open
+            return False
+        try: #Try to read the keys
+            with open(input_file, 'r', newline='', errors='surrogateescape') as f:
+                keys = [self.layout.parse(row[0].strip()) for row in csv.reader(f) if row and row[0].strip()]
+        except (OSError, ValueError, csv.Error) as e: #Catch a missing file or a line that is not a key
+            print(f"Error reading keys: {e}")
+            return False
+        results = self.search_many(keys) #One walk of the tree for the whole batch
+        found = 0
+        for key in keys:
+            value = results[key]
+            if value is None:
+                print(f"Error: Key {key} not found.")
+            else:
+                print(f"Key: {key}, Value: {value}")
+                found += 1
+        print(f"Found {found} of {len(keys)} keys.")
+        return True
+
+    #RANGE COMMAND
+    #Print the key-value pairs with lo <= key <= hi
+    def range_search(self, lo, hi):
+        if not self.is_file_open(): #Check if the file is open
+            return
+        count = 0
+        for key, value in self.scan(lo, hi): #Walk the range in key order
+            print(f"Key: {key}, Value: {value}")
+            count += 1
+        print(f"{count} keys in range {lo} to {hi}.")
+
+    #Yield the (key, value) pairs with lo <= key <= hi in key order (None leaves that end of the range open).
+    #Pairs are produced lazily. A concurrent tree holds the read lock until the scan is finished or closed, so the
+    #thread running a scan must not insert before it is done
+    def scan(self, lo=None, hi=None):
+        with self._reading():
+            for keys, values in self._walk(lo, hi):
+                yield from zip(keys, self._load_values(values))
 
+    #Yield the pairs of a scan in runs: (keys, values) arrays holding the in-range part of a leaf, or the single
+    #key of an internal node between two of its children. The walk seeks straight to the first key >= lo and keeps
+    #its position on an explicit stack of [node, index] entries instead of recursing
+    def _walk(self, lo=None, hi=None):
+        if not self.file or self.header.root_id == 0: #Nothing to scan
+            return
+        stack = [] #Every node on the path to the current position, with the index of the child being walked
+        node = self.load_node(self.header.root_id)
+        while True: #Seek: descend towards the first key >= lo
+            i = 0 if lo is None else bisect_left(node.keys, lo, 0, node.num_keys)
+            stack.append([node, i])
+            if node.is_leaf:
+                break
+            node = self.load_node(node.children[i])
+        while stack:
+            node, i = stack[-1]
+            if node.is_leaf: #Yield the rest of the leaf, then go back up
+                stack.pop()
+                end = node.num_keys if hi is None else bisect_right(node.keys, hi, i, node.num_keys)
+                if end > i:
+                    yield node.keys[i:end], node.values[i:end]
+                if end < node.num_keys: #Past the end of the range
+                    return
+                continue
+            if i >= node.num_keys: #Every child of this node has been walked
+                stack.pop()
+                continue
+            key = node.keys[i] #Child i is done: the key after it comes next
+            if hi is not None and key > hi:
+                return
+            yield node.keys[i:i + 1], node.values[i:i + 1]
+            stack[-1][1] = i + 1
+            node = self.load_node(node.children[i + 1]) #Then the leftmost path of the next child
+            while True:
+                stack.append([node, 0])
+                if node.is_leaf:
+                    break
+                node = self.load_node(node.children[0])
     
     #PRINT COMMAND
+    @reads_tree
     def print_tree(self): #Print the key-value pairs in the B-Tree
         if not self.is_file_open(): #Check if the file is open
             return
@@ -287,103 +1736,742 @@ class BTree:
         for i in range(node.num_keys):# Print the key-value pairs
             if node.children[i] != 0: # Recursively print child nodes
                 self._print_recursive(self.load_node(node.children[i]))
-            print(f"Key: {node.keys[i]}, Value: {node.values[i]}")
+            print(f"Key: {node.keys[i]}, Value: {self._load_value(node.values[i])}")
         if node.children[node.num_keys] != 0: # Recursively print the last child node
             self._print_recursive(self.load_node(node.children[node.num_keys]))
     
     #EXTRACT COMMAND
-    def extract(self, output_file): #Extract the key-value pairs to a file
+    #Extract the key-value pairs to a file. fmt is a key of EXPORT_FORMATS (BYTES_EXPORT_FORMATS for byte keys); by
+    #default files ending in .bin get the binary format and everything else CSV. The tree is walked in key order and written in large batches.
+    #overwrite works as in create_file
+    @reads_tree
+    def extract(self, output_file, fmt=None, overwrite=None):
         if not self.is_file_open(): #Check if the file is open
-            return
+            return False
         if self.header.root_id == 0: #Check if the B-Tree is empty
             print("The tree is empty.")
-            return
-        if os.path.exists(output_file): #Check if the output file already exists
+            return True
+        fmt = fmt or file_format(output_file)
+        encoders = self.layout.encoders() #Formats of the file's key format
+        if fmt not in encoders: #Check the output format
+            print(f"unknown format '{fmt}'. use one of: {', '.join(encoders)}.")
+            return False
+        if os.path.exists(output_file) and not overwrite: #Check if the output file already exists
+            if overwrite is False:
+                raise FileExistsError(f"file '{output_file}' exists.")
             overwrite = input(f"File '{output_file}' exists. Overwrite? (yes/no): ").strip().lower()
             if overwrite != 'yes': #
                 print("Extraction aborted.") #Abort the extraction if the user does not want to overwrite the file
-                return
-        with open(output_file, 'w') as f: #Open the output file in write mode
-            self._extract_recursive(self.load_node(self.header.root_id), f) # Recursively extract the key-value pairs
-        print(f"Extracted to {output_file}.")
-    #Recursive extract function to extract the key-value pairs to a file
-    def _extract_recursive(self, node, file_handle):
-        for i in range(node.num_keys): # Extract the key-value pairs
-            if node.children[i] != 0: # Recursively extract child nodes
-                self._extract_recursive(self.load_node(node.children[i]), file_handle)
-            file_handle.write(f"{node.keys[i]},{node.values[i]}\n") # Write the key-value pair to the file
-        if node.children[node.num_keys] != 0: # Recursively extract the last child node
-            self._extract_recursive(self.load_node(node.children[node.num_keys]), file_handle)
+                return False
+        encode = encoders[fmt]
+        count = 0
+        with open(output_file, 'wb', buffering=BULK_WRITE_SIZE) as f: #Open the output file in write mode
+            batch_keys = self.layout.new_batch() #Pairs waiting to be encoded
+            batch_values = self.layout.new_batch()
+            for keys, values in self._walk(): #Runs of pairs in key order
+                batch_keys += keys
+                batch_values += self._load_values(values)
+                if len(batch_keys) >= EXPORT_BATCH_SIZE: #Encode and write the batch in one go
+                    f.write(encode(batch_keys, batch_values))
+                    count += len(batch_keys)
+                    batch_keys = self.layout.new_batch()
+                    batch_values = self.layout.new_batch()
+            f.write(encode(batch_keys, batch_values)) #Write the last batch
+            count += len(batch_keys)
+        print(f"Extracted {count} key-value pairs to {output_file}.")
+        return True
     
     #LOAD COMMAND 
-    def load(self, input_file): #Load the key-value pairs from a file
+    @writes_tree
+    def load(self, input_file, bulk=False): #Load the key-value pairs from a file. Returns False if it failed
         if not self.is_file_open(): #Check if the file is open
             print("there is no file that is open. use 'CREATE' or 'OPEN' first to create/open a file.")
-            return
+            return False
+        if bulk: #Sorted bulk load builds the tree bottom-up, which only works on an empty tree
+            if self.header.root_id == 0:
+                try:
+                    self.bulk_load(input_file)
+                except Exception as e: #Catch any exceptions that occur while bulk loading
+                    print(f"Error loading file: {e}")
+                    return False
+                return True
+            print("bulk load needs an empty tree. falling back to a regular load.")
         try: #Try to load the key-value pairs from the file
-            with open(input_file, 'r') as f: #Open the input file in read mode
-                for line in f: #Read each line in the file
-                    key, value = map(int, line.strip().split(',')) #Split the line by comma and convert the values to integers
-                    if self.search(key, show_error=False) is not None:  #Check if the key already exists in the B-Tree to avoid duplicates
-                        print(f"Skipping duplicate key: {key}")
-                        continue #Skip the key if it already exists
-                    self.insert(key, value) #Insert the key-value pair into the B-Tree
+            for key, value in self.layout.read_pairs(input_file): #Read each pair in the file
+                new_root = self.header.root_id == 0
+                if not self._insert(key, value): #Insert the key-value pair, the descent finds duplicates on the way
+                    print(f"Skipping duplicate key: {key}")
+                    continue #Skip the key if it already exists
+                self._commit() #Every row is its own operation, group commit makes them durable together
+                print(f"Inserted key {key} into a new root." if new_root else f"Inserted key {key}.")
             print(f"Loaded key-value pairs from '{input_file}'.") #Print a message if the key-value pairs are loaded successfully
         except Exception as e: #Catch any exceptions that occur while loading the key-value pairs
             print(f"Error loading file: {e}")
+            return False
+        return True
 
-#MAIN FUNCTION
-def main():
-    btree = None #Create a new B-Tree object
-    while True: #Run an infinite loop to accept user commands
-        print("\nCommands: CREATE, OPEN, INSERT, SEARCH, LOAD, PRINT, EXTRACT, QUIT") #Print the available commands
-        command = input("Enter command: ").strip().lower() #Get the user command
-        #Create command
-        if command == 'create': 
-            file_name = input("Enter file name: ").strip() #Get the file name from the user
-            btree = BTree(file_name) #Create a new B-Tree object
-            btree.create_file() #Create a new file
-        #Open command
-        elif command == 'open':
-            file_name = input("Enter file name: ").strip() #Get the file name from the user
-            try: #Try to open the file
-                btree = BTree(file_name) #Create a new B-Tree object
-                btree.open_file() #Open the file
-                print(f"Opened file '{file_name}' successfully.")
-            except Exception as e: #Catch any exceptions that occur while opening the file
-                print(f"Error opening file: {e}")
-        #Insert, Search, Print, Extract, Load commands
-        elif command in ['insert', 'search', 'print', 'extract', 'load']:
-            if not btree or not btree.file: #Check if the file is open
-                print("no file is open. you can use the 'CREATE' or 'OPEN' first to open a file.") #Print an error message if the file is not open
+    #BULK LOAD
+    #Sorts and deduplicates the input file and packs it bottom-up into full nodes, writing the blocks
+    #sequentially in one pass and the header once at the end. Raises ValueError if the tree is not empty
+    @writes_tree
+    def bulk_load(self, input_file):
+        if self.header.root_id != 0: #The new tree would replace the old one and leave its blocks unreachable
+            raise ValueError("bulk load needs an empty tree.")
+        count, pairs, duplicates = self._sorted_unique_pairs(input_file) #Sorted stream of unique pairs
+        if count == 0:
+            print(f"No key-value pairs found in '{input_file}'.")
+            return
+        self.pool.flush() #Nothing buffered may be written over the new blocks later
+        storage = self.storage.unlogged() #With the log on, the new blocks go straight to the index file
+        root_id, next_block_id = self._build_tree(pairs, count, storage, self.header.next_block_id)
+        if storage is not self.storage: #The blocks must be durable before the logged header points to them
+            storage.flush()
+            os.fsync(storage.file.fileno())
+        self.pool.clear() #Nothing cached can describe the new blocks
+        self.header.root_id = root_id
+        self.header.next_block_id = next_block_id
+        self.flush() #Header is written once at the end (and committed when the log is on)
+        if duplicates:
+            print(f"Skipped {duplicates} duplicate keys.")
+        print(f"Bulk loaded {count} key-value pairs from '{input_file}'.")
+
+    #Packs `count` sorted unique pairs bottom-up into full nodes written to storage from block next_block_id on,
+    #in one sequential pass: the leaves in key order first, then each internal level. Returns the block ID of the
+    #root and the first block ID after the tree
+    def _build_tree(self, pairs, count, storage, next_block_id):
+        layout = self.layout
+        if layout.key_format == KEYS_BYTES: #Node sizes depend on the keys
+            return self._build_packed(pairs, storage, next_block_id)
+        batch_start = next_block_id #Block ID of the first block in the buffer
+        buffer = bytearray() #Blocks are written in large batches instead of one at a time
+        #Leaf level: each leaf is followed by one separator key that moves up to the parent level
+        leaf_count = -(-(count + 1) // (layout.max_keys + 1)) #Fewest leaves that can hold every key
+        base, extra = divmod(count - (leaf_count - 1), leaf_count) #Spread the keys evenly so no leaf underflows
+        child_ids = [] #Block IDs of the level just written
+        separators = [] #Keys that separate the nodes of the level just written
+        for j in range(leaf_count):
+            node = layout.new_node(next_block_id) #New leaf
+            node.num_keys = base + (1 if j < extra else 0)
+            for i in range(node.num_keys): #Fill the leaf with the next keys in order
+                node.keys[i], node.values[i] = next(pairs)
+            if j < leaf_count - 1: #Every leaf but the last is followed by a separator
+                separators.append(next(pairs))
+            buffer += node.to_bytes()
+            child_ids.append(next_block_id)
+            next_block_id += 1
+            if len(buffer) >= BULK_WRITE_SIZE: #Write the batch once it is large enough
+                storage.write_blocks(batch_start, buffer)
+                batch_start = next_block_id
+                buffer.clear()
+        #Internal levels: group the children of the level below until a single root is left
+        while len(child_ids) > 1:
+            group_count = -(-len(child_ids) // layout.max_children) #Fewest nodes that can hold every child
+            base, extra = divmod(len(child_ids), group_count) #Spread the children evenly
+            level_ids = []
+            level_separators = []
+            child_index = 0 #Position in child_ids (separator i sits between child i and child i + 1)
+            for j in range(group_count):
+                node = layout.new_node(next_block_id) #New internal node
+                child_total = base + (1 if j < extra else 0)
+                node.num_keys = child_total - 1
+                for i in range(child_total): #Take the children and the separators between them
+                    node.children[i] = child_ids[child_index + i]
+                    if i < child_total - 1:
+                        node.keys[i], node.values[i] = separators[child_index + i]
+                child_index += child_total
+                if j < group_count - 1: #The separator after this group moves up again
+                    level_separators.append(separators[child_index - 1])
+                buffer += node.to_bytes()
+                level_ids.append(next_block_id)
+                next_block_id += 1
+                if len(buffer) >= BULK_WRITE_SIZE:
+                    storage.write_blocks(batch_start, buffer)
+                    batch_start = next_block_id
+                    buffer.clear()
+            child_ids = level_ids
+            separators = level_separators
+        storage.write_blocks(batch_start, buffer) #Write the last batch
+        return child_ids[0], next_block_id #The last node written is the root
+
+    #Byte keys: packs the sorted pairs into slotted pages filled as far as each block allows (node sizes cannot be
+    #worked out from the count), in the same single sequential pass as _build_tree. Long values are written to
+    #their overflow pages as the pairs come in. Returns the block ID of the root and the first block ID after it
+    def _build_packed(self, pairs, storage, next_block_id):
+        layout = self.layout
+        batch_start = next_block_id #Block ID of the first block in the buffer
+        buffer = bytearray() #Blocks are written in large batches instead of one at a time
+        def write(block): #Adds the next block of the pass and returns its block ID
+            nonlocal next_block_id, batch_start
+            buffer.extend(block)
+            next_block_id += 1
+            if len(buffer) >= BULK_WRITE_SIZE: #Write the batch once it is large enough
+                storage.write_blocks(batch_start, buffer)
+                batch_start = next_block_id
+                buffer.clear()
+            return next_block_id - 1
+        def write_node(keys, values, children=None):
+            node = layout.new_node(next_block_id)
+            node.keys, node.values, node.num_keys = keys, values, len(keys)
+            if children:
+                node.children = children
+            return write(node.to_bytes())
+        def store(value): #Long values go to overflow pages right away
+            if len(value) <= layout.max_inline:
+                return value
+            pages = range(next_block_id, next_block_id + layout.overflow_count(value))
+            for _, block in layout.overflow_blocks(value, pages):
+                write(block)
+            return OverflowRef(pages[0], len(value))
+        #Leaf level: a pair that does not fit in the leaf being filled separates it from the next leaf. The last
+        #full leaf is held back so that, if the very last pair became a separator, it can give its last key up
+        child_ids = [] #Block IDs of the level just written
+        separators = [] #Keys that separate the nodes of the level just written
+        held = None
+        keys, values, used = [], [], PAGE_HEAD_FORMAT.size
+        for key, value in pairs:
+            value = store(value)
+            size = cell_size(keys[-1] if keys else b'', key, value, False)
+            if keys and used + size > layout.block_size: #The leaf is full
+                if held:
+                    child_ids.append(write_node(*held))
+                held = (keys, values)
+                separators.append((key, value))
+                keys, values, used = [], [], PAGE_HEAD_FORMAT.size
                 continue
-            #Insert Command
-            if command == 'insert':
-                key = int(input("Enter key: ")) #Get the key from the user
-                value = int(input("Enter value: ")) #Get the value from the user
-                btree.insert(key, value) #Insert the key-value pair into the B-Tree
-            #Search Command
-            elif command == 'search':
-                key = int(input("Enter key: ")) #Get the key from the user
-                btree.search(key, show_error=True) #Search for the key in the B-Tree
-            #Print Command
-            elif command == 'print':
-                btree.print_tree() #Print the key-value pairs in the B-Tree
-            #Extract Command
-            elif command == 'extract':
-                output_file = input("Enter output file name: ").strip() #Get the output file name from the user
-                btree.extract(output_file) #Extract the key-value pairs to a file
-            #Load Command
-            elif command == 'load': 
-                input_file = input("Enter input file name: ").strip() #Get the input file name from the user
-                btree.load(input_file) #Load the key-value pairs from the file
-        #Quit Command
-        elif command == 'quit':
-            if btree: #Check if the B-Tree object exists
-                btree.close_file() #Close the file
+            keys.append(key)
+            values.append(value)
+            used += size
+        if not keys: #The last pair is a separator: it becomes the last leaf and the held leaf's last key separates
+            keys, values = [separators[-1][0]], [separators[-1][1]]
+            separators[-1] = (held[0].pop(), held[1].pop())
+        if held:
+            child_ids.append(write_node(*held))
+        child_ids.append(write_node(keys, values))
+        #Internal levels: the same over the children of the level below and the separators between them, until a
+        #single root is left. A last node with a single child takes the last key and child of the node before it
+        while len(child_ids) > 1:
+            level_ids = []
+            level_separators = []
+            held = None
+            keys, values, children, used = [], [], [child_ids[0]], PAGE_HEAD_FORMAT.size
+            for (key, value), child in zip(separators, child_ids[1:]):
+                size = cell_size(keys[-1] if keys else b'', key, value, True)
+                if keys and used + size > layout.block_size: #The node is full
+                    if held:
+                        level_ids.append(write_node(*held))
+                    held = (keys, values, children)
+                    level_separators.append((key, value))
+                    keys, values, children, used = [], [], [child], PAGE_HEAD_FORMAT.size
+                    continue
+                keys.append(key)
+                values.append(value)
+                children.append(child)
+                used += size
+            if not keys:
+                keys, values = [level_separators[-1][0]], [level_separators[-1][1]]
+                children = [held[2].pop(), children[0]]
+                level_separators[-1] = (held[0].pop(), held[1].pop())
+            if held:
+                level_ids.append(write_node(*held))
+            level_ids.append(write_node(keys, values, children))
+            child_ids = level_ids
+            separators = level_separators
+        storage.write_blocks(batch_start, buffer) #Write the last batch
+        return child_ids[0], next_block_id #The last node written is the root
+
+    #Reads the input file and returns the number of unique pairs, an iterator over them sorted by key and the
+    #number of duplicates dropped. The first occurrence of a key wins, just like the regular load. Input that
+    #does not fit in BULK_RUN_SIZE rows is sorted in runs on disk and merged (external merge sort)
+    def _sorted_unique_pairs(self, input_file):
+        runs = [] #Sorted runs spilled to temporary files
+        chunk = []
+        total = 0 #Pairs read
+        for pair in self.layout.read_pairs(input_file):
+            chunk.append(pair)
+            total += 1
+            if len(chunk) >= BULK_RUN_SIZE: #Spill the chunk once it is full
+                runs.append(self._spill_run(chunk))
+                chunk = []
+        chunk.sort(key=itemgetter(0)) #Stable sort, so earlier duplicates stay first
+        if not runs: #Everything fit in memory
+            unique = self._unique_pairs(chunk)
+            pairs = list(unique)
+            return len(pairs), iter(pairs), len(chunk) - len(pairs)
+        if chunk:
+            runs.append(self._spill_run(chunk, presorted=True))
+        #Merge the runs into one sorted file so the number of unique keys is known before any block is laid out
+        merged = tempfile.TemporaryFile()
+        count = 0
+        batch = bytearray()
+        pack = self.layout.pack_pair #Binary record of the file's key format
+        sources = [self._read_run(run) for run in runs]
+        for key, value in self._unique_pairs(heapq.merge(*sources, key=itemgetter(0))): #heapq.merge keeps run order on ties
+            batch += pack(key, value)
+            count += 1
+            if len(batch) >= BULK_WRITE_SIZE:
+                merged.write(batch)
+                batch.clear()
+        merged.write(batch)
+        for run in runs: #The runs are not needed once merged
+            run.close()
+        merged.seek(0)
+        return count, self._read_run(merged, close=True), total - count
+
+    #Sorts a chunk of pairs and writes it to a temporary file
+    def _spill_run(self, chunk, presorted=False):
+        if not presorted:
+            chunk.sort(key=itemgetter(0)) #Stable sort keeps the file order of duplicates
+        run = tempfile.TemporaryFile()
+        pack = self.layout.pack_pair
+        run.write(b''.join(pack(key, value) for key, value in chunk))
+        run.seek(0)
+        return run
+
+    #Reads the pairs of a run back in large blocks
+    def _read_run(self, run, close=False):
+        yield from self.layout.read_binary(run)
+        if close:
+            run.close()
+
+    #Drops every pair whose key equals the key of the pair before it
+    @staticmethod
+    def _unique_pairs(pairs):
+        last_key = None
+        for key, value in pairs:
+            if key != last_key:
+                last_key = key
+                yield key, value
+
+#IMPORT/EXPORT FORMATS
+#Format of a key-value file: files ending in .bin hold binary records, everything else is CSV
+def file_format(file_name):
+    return 'bin' if file_name.lower().endswith('.bin') else 'csv'
+
+#CSV: one "key,value" line per pair. One % over the whole batch is much cheaper than formatting pair by pair
+def encode_csv(keys, values):
+    flat = [0] * (2 * len(keys)) #key, value, key, value, ...
+    flat[0::2] = keys
+    flat[1::2] = values
+    return (('%d,%d\n' * len(keys)) % tuple(flat)).encode()
+
+#Binary: fixed width big-endian records of an 8 byte key and an 8 byte value (PAIR_FORMAT), the format the
+#bulk load sorts in, so an extracted .bin file can be loaded straight back
+def encode_binary(keys, values):
+    flat = array('Q', bytes(16 * len(keys)))
+    flat[0::2] = keys
+    flat[1::2] = values
+    if NATIVE_LITTLE_ENDIAN: #Records are big-endian
+        flat.byteswap()
+    return flat.tobytes()
+
+EXPORT_FORMATS = {'csv': encode_csv, 'bin': encode_binary} #Output formats of EXTRACT
+
+#CSV of byte strings: the csv module quotes keys and values holding commas, quotes or line breaks (lines end in
+#\r\n, which is what makes it quote a lone \r too). Bytes that are not UTF-8 are written as surrogate escapes so
+#they come back unchanged
+def encode_bytes_csv(keys, values):
+    out = io.StringIO(newline='')
+    writer = csv.writer(out, lineterminator='\r\n')
+    writer.writerows((key.decode('utf-8', 'surrogateescape'), value.decode('utf-8', 'surrogateescape'))
+                     for key, value in zip(keys, values))
+    return out.getvalue().encode('utf-8', 'surrogateescape')
+
+#Binary of byte strings: records of the key and value lengths (BYTE_PAIR_FORMAT) followed by the key and value
+def encode_bytes_binary(keys, values):
+    head = BYTE_PAIR_FORMAT.pack
+    return b''.join(head(len(key), len(value)) + key + value for key, value in zip(keys, values))
+
+BYTES_EXPORT_FORMATS = {'csv': encode_bytes_csv, 'bin': encode_bytes_binary} #Output formats of EXTRACT for byte keys
+
+#Yields the pairs of a binary file opened in binary mode, reading it in large blocks
+def read_binary_pairs(f):
+    rest = b'' #Part of a record cut off by the end of a block
+    while True:
+        data = f.read(BULK_WRITE_SIZE)
+        if not data:
+            break
+        data = rest + data
+        end = len(data) - len(data) % PAIR_FORMAT.size
+        yield from PAIR_FORMAT.iter_unpack(data[:end])
+        rest = data[end:]
+    if rest:
+        raise ValueError("binary file ends in the middle of a record.")
+
+#Yields the byte string pairs of a binary file opened in binary mode, reading it in large blocks
+def read_byte_pairs(f):
+    data = b''
+    offset = 0 #Start of the next record in data
+    while True:
+        more = f.read(BULK_WRITE_SIZE)
+        if not more:
             break
-        #Invalid Command
+        data = data[offset:] + more
+        offset = 0
+        while offset + BYTE_PAIR_FORMAT.size <= len(data):
+            key_length, value_length = BYTE_PAIR_FORMAT.unpack_from(data, offset)
+            start = offset + BYTE_PAIR_FORMAT.size
+            end = start + key_length + value_length
+            if end > len(data): #The record goes on in the next block
+                break
+            yield data[start:start + key_length], data[start + key_length:end]
+            offset = end
+    if offset < len(data):
+        raise ValueError("binary file ends in the middle of a record.")
+
+#Yields the byte string pairs of a CSV or binary (.bin) file. CSV fields are read as UTF-8 text
+def read_byte_pairs_file(input_file):
+    if file_format(input_file) == 'bin':
+        with open(input_file, 'rb') as f:
+            yield from read_byte_pairs(f)
+        return
+    with open(input_file, 'r', encoding='utf-8', errors='surrogateescape', newline='') as f:
+        for row in csv.reader(f):
+            if not row: #Skip blank lines
+                continue
+            if len(row) != 2:
+                raise ValueError(f"line {','.join(row)!r} is not a key-value pair.")
+            yield row[0].encode('utf-8', 'surrogateescape'), row[1].encode('utf-8', 'surrogateescape')
+
+#Yields the (key, value) pairs of a CSV or binary (.bin) file, checking that they fit in unsigned 64 bits
+def read_pairs(input_file):
+    if file_format(input_file) == 'bin':
+        with open(input_file, 'rb') as f:
+            yield from read_binary_pairs(f)
+        return
+    with open(input_file, 'r') as f: #Open the input file in read mode
+        for line in f:
+            line = line.strip()
+            if not line: #Skip blank lines
+                continue
+            key, value = map(int, line.split(',')) #Split the line by comma and convert the values to integers
+            if not (0 <= key < 2**64 and 0 <= value < 2**64): #Keys and values are stored as unsigned 64-bit integers
+                raise ValueError(f"key-value pair {key},{value} does not fit in 64 bits.")
+            yield key, value
+
+#QUERY SERVER
+#Keeps one B-Tree open with a warm buffer pool and answers requests from many clients, one line per request:
+#  GET key             -> VALUE value | NOT_FOUND
+#  PUT key value       -> OK | EXISTS
+#  DELETE key          -> OK | NOT_FOUND
+#  RANGE lo hi [limit] -> one "key value" line per pair in key order, then END count
+#  QUIT                -> closes the connection
+#Anything else gets ERROR and a message. Requests run one at a time on the event loop, so a request never sees
+#another one half done and the tree needs no locking
+class IndexServer:
+    #Constructor
+    def __init__(self, btree):
+        self.btree = btree
+        self.requests = 0 #Requests answered
+    #Answers one request (the words of its line)
+    def answer(self, words):
+        btree = self.btree
+        command = words[0].upper()
+        layout = btree.layout
+        try: #Keys and values in the file's key format; the limit of RANGE is a count
+            numbers = [int(word) if command == 'RANGE' and i == 2 else layout.parse(word) for i, word in enumerate(words[1:])]
+            if command == 'RANGE' and len(numbers) == 3 and numbers[2] < 0:
+                raise ValueError("the limit of RANGE must not be negative")
+        except ValueError as e:
+            return f"ERROR {e}\n".encode()
+        if command == 'GET' and len(numbers) == 1:
+            value = btree._search(numbers[0]) if btree.header.root_id else None
+            return b"NOT_FOUND\n" if value is None else f"VALUE {layout.text(value)}\n".encode('utf-8', 'surrogateescape')
+        if command == 'PUT' and len(numbers) == 2:
+            try:
+                if not btree._insert(*numbers):
+                    return b"EXISTS\n"
+            except ValueError as e: #A pair the file cannot store
+                return f"ERROR {e}\n".encode()
+            btree._commit() #Durable with its group when the log is on (handle waits for it before replying)
+            return b"OK\n"
+        if command == 'DELETE' and len(numbers) == 1:
+            if not btree._delete(numbers[0]):
+                return b"NOT_FOUND\n"
+            btree._commit()
+            return b"OK\n"
+        if command == 'RANGE' and len(numbers) in (2, 3):
+            pairs = btree.scan(numbers[0], numbers[1])
+            if len(numbers) == 3: #At most limit pairs
+                pairs = islice(pairs, numbers[2])
+            lines = [f"{layout.text(key)} {layout.text(value)}\n" for key, value in pairs]
+            lines.append(f"END {len(lines)}\n")
+            return ''.join(lines).encode('utf-8', 'surrogateescape')
+        return b"ERROR usage: GET key | PUT key value | DELETE key | RANGE lo hi [limit] | QUIT\n"
+    #With the log on: waits until every commit made so far is synced, so a change is only acknowledged once it is
+    #durable. Clients writing at the same time wait for the same group and share its fsync
+    async def durable(self):
+        storage = self.btree.storage
+        if not isinstance(storage, WalStorage):
+            return
+        wal = storage.wal
+        target = wal.commits
+        while wal.synced < target:
+            await asyncio.sleep(max(0, wal.first_wait + wal.commit_interval - time.monotonic()))
+            self.btree.sync_due()
+    #Serves one connection until the client sends QUIT or disconnects
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line: #Disconnected
+                    break
+                words = line.decode(errors='replace').split()
+                if not words:
+                    continue
+                if words[0].upper() == 'QUIT':
+                    break
+                try:
+                    reply = self.answer(words)
+                    if words[0].upper() in ('PUT', 'DELETE'):
+                        await self.durable()
+                except Exception as e: #A request that fails must not take the connection down with it
+                    reply = f"ERROR {type(e).__name__}: {e}\n".encode(errors='replace')
+                writer.write(reply)
+                self.requests += 1
+                await writer.drain() #Wait for slow clients instead of buffering their answers
+        except ConnectionError: #The client went away
+            pass
+        finally:
+            writer.close()
+    #Listens on a TCP port, or on a Unix socket when unix_path is given, until SIGINT or SIGTERM
+    async def serve(self, host=SERVER_HOST, port=SERVER_PORT, unix_path=None):
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle, unix_path)
+            where = unix_path
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            where = f"{host}:{port}"
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        print(f"Serving '{self.btree.file_name}' on {where}.", flush=True)
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            if unix_path and os.path.exists(unix_path):
+                os.remove(unix_path)
+        print(f"Stopped after {self.requests} requests.")
+
+#COMMAND LINE
+#Commands accepted on the command line and in scripts: (fewest arguments, most arguments, usage)
+CLI_COMMANDS = {
+    'create': (0, 2, "create [BLOCK_SIZE [DEGREE|bytes]]"),
+    'insert': (2, 2, "insert KEY VALUE"),
+    'delete': (1, 1, "delete KEY"),
+    'search': (1, 1, "search KEY|KEY_FILE"),
+    'range': (2, 2, "range LO HI"),
+    'load': (1, 2, "load FILE [bulk]"),
+    'print': (0, 0, "print"),
+    'extract': (1, 2, "extract FILE [csv|bin]"),
+    'compact': (0, 0, "compact"),
+    'stats': (0, 0, "stats"),
+    'serve': (0, 0, "serve [--host HOST] [--port PORT | --unix PATH]"),
+}
+
+#Whether the word given to SEARCH names a file of keys rather than a key: for integer keys anything that is not a
+#number, for byte keys (where any word is a key) a file that exists
+def is_key_file(btree, word):
+    if btree.layout.key_format == KEYS_BYTES:
+        return os.path.isfile(word)
+    try:
+        int(word)
+    except ValueError:
+        return True
+    return False
+
+#Runs one command on the tree without asking anything. Raises ValueError for a malformed command or a command
+#that failed (the methods behind load, extract and batch search print their errors and return False)
+def run_command(btree, words, options):
+    command, params = words[0].lower(), words[1:]
+    if command not in CLI_COMMANDS:
+        raise ValueError(f"unknown command '{words[0]}'. use one of: {', '.join(CLI_COMMANDS)}.")
+    fewest, most, usage = CLI_COMMANDS[command]
+    if not fewest <= len(params) <= most:
+        raise ValueError(f"usage: {usage}")
+    if command == 'create': #Replaces the open file
+        btree.close_file()
+        block_size = int(params[0]) if params else BLOCK_SIZE
+        shape = params[1].lower() if len(params) == 2 else None #A degree, or the name of a key format
+        if shape in KEY_FORMATS:
+            btree.create_file(block_size, overwrite=options.overwrite, key_format=KEY_FORMATS[shape])
         else:
-            print("Invalid command. Please try again.")
+            btree.create_file(block_size, int(shape) if shape else None, overwrite=options.overwrite)
+        return
+    if not btree.file: #Every other command works on the index file, opened once
+        btree.open_file(storage=options.storage)
+    parse = btree.layout.parse #Keys and values in the file's key format
+    if command == 'insert':
+        btree.insert(parse(params[0]), parse(params[1]))
+    elif command == 'delete':
+        btree.delete(parse(params[0]))
+    elif command == 'search':
+        if is_key_file(btree, params[0]):
+            if not btree.search_batch(params[0]):
+                raise ValueError(f"could not read the keys in '{params[0]}'.")
+        else:
+            btree.search(parse(params[0]))
+    elif command == 'range':
+        btree.range_search(parse(params[0]), parse(params[1]))
+    elif command == 'load':
+        if len(params) == 2 and params[1].lower() != 'bulk':
+            raise ValueError(f"usage: {usage}")
+        if not btree.load(params[0], bulk=len(params) == 2):
+            raise ValueError(f"could not load '{params[0]}'.")
+    elif command == 'print':
+        btree.print_tree()
+    elif command == 'extract':
+        if not btree.extract(params[0], params[1].lower() if len(params) == 2 else None, overwrite=options.overwrite):
+            raise ValueError(f"could not extract to '{params[0]}'.")
+    elif command == 'compact':
+        btree.compact()
+    elif command == 'stats':
+        for name, value in btree.cache_stats().items():
+            print(f"{name}: {value:.2%}" if name == 'hit_rate' else f"{name}: {value}")
+    elif command == 'serve':
+        asyncio.run(IndexServer(btree).serve(options.host, options.port, options.unix))
+
+#Reads the commands of a script: one command per line, blank lines and lines starting with # are skipped
+def read_script(script_file):
+    f = sys.stdin if script_file == '-' else open(script_file, 'r')
+    try:
+        return [line.split() for line in f if line.strip() and not line.lstrip().startswith('#')]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+#Runs a command given on the command line, or every command of a script, on one index file. Returns the exit
+#status: 0, or 1 after the first command that fails
+def run_cli(argv):
+    parser = argparse.ArgumentParser(prog='main.py', description="B-tree index file. Without arguments an interactive menu is shown.",
+                                     epilog="commands: " + "; ".join(usage for _, _, usage in CLI_COMMANDS.values()))
+    parser.add_argument('index', help="index file")
+    parser.add_argument('command', nargs='*', help="command and its arguments (see below)")
+    parser.add_argument('-f', '--script', help="file of commands to run, one per line ('-' reads standard input)")
+    parser.add_argument('-y', '--overwrite', action='store_true', help="replace existing files on create/extract instead of failing")
+    parser.add_argument('--cache', type=int, help="buffer pool size in blocks")
+    parser.add_argument('--wal', action='store_true', help="turn on the write-ahead log")
+    parser.add_argument('--storage', choices=list(STORAGE_MODES), default='file', help="storage mode of the index file")
+    parser.add_argument('--host', default=SERVER_HOST, help="address the server listens on")
+    parser.add_argument('--port', type=int, default=SERVER_PORT, help="TCP port the server listens on")
+    parser.add_argument('--unix', help="listen on this Unix socket instead of a TCP port")
+    options = parser.parse_intermixed_args(argv) #Options may also follow the index file or the command
+    if bool(options.command) == bool(options.script):
+        parser.error("give either a command or a script")
+    commands = read_script(options.script) if options.script else [options.command]
+    btree = BTree(options.index, cache_blocks=options.cache, wal=options.wal)
+    try:
+        for words in commands:
+            run_command(btree, words, options)
+    except (ValueError, OverflowError, OSError) as e: #Bad arguments, missing or existing files, invalid index files
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        btree.close_file() #Write back everything the commands changed
+    return 0
+
+#MAIN FUNCTION
+#Runs the command line when arguments are given, otherwise the interactive menu
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        return run_cli(argv)
+    menu()
+    return 0
+
+#INTERACTIVE MENU
+def menu():
+    btree = None #Create a new B-Tree object
+    try: #Whatever ends the loop, the changes buffered in the pool are written back (finally)
+        while True: #Run an infinite loop to accept user commands
+            print("\nCommands: CREATE, OPEN, INSERT, DELETE, SEARCH, RANGE, LOAD, PRINT, EXTRACT, COMPACT, STATS, QUIT") #Print the available commands
+            command = input("Enter command: ").strip().lower() #Get the user command
+            #Create command
+            if command == 'create': 
+                file_name = input("Enter file name: ").strip() #Get the file name from the user
+                block_size = input(f"Enter block size in bytes [{BLOCK_SIZE}]: ").strip() or str(BLOCK_SIZE) #Default block size if left empty
+                degree = input("Enter degree, or 'bytes' for byte string keys [largest that fits the block]: ").strip().lower() #Largest degree if left empty
+                if btree: #Write back and close the file that is open
+                    btree.close_file()
+                try: #Try to create the file
+                    btree = BTree(file_name) #Create a new B-Tree object
+                    if degree in KEY_FORMATS: #Keys of another format, which has no degree
+                        btree.create_file(int(block_size), key_format=KEY_FORMATS[degree])
+                    else:
+                        btree.create_file(int(block_size), int(degree) if degree else None) #Create a new file
+                except ValueError as e: #Catch an invalid block size or degree
+                    print(f"Error creating file: {e}")
+            #Open command
+            elif command == 'open':
+                file_name = input("Enter file name: ").strip() #Get the file name from the user
+                if btree: #Write back and close the file that is open
+                    btree.close_file()
+                try: #Try to open the file
+                    btree = BTree(file_name) #Create a new B-Tree object
+                    btree.open_file() #Open the file
+                    print(f"Opened file '{file_name}' successfully.")
+                except Exception as e: #Catch any exceptions that occur while opening the file
+                    print(f"Error opening file: {e}")
+            #Insert, Search, Print, Extract, Load commands
+            elif command in ['insert', 'delete', 'search', 'range', 'print', 'extract', 'load', 'compact', 'stats']:
+                if not btree or not btree.file: #Check if the file is open
+                    print("no file is open. you can use the 'CREATE' or 'OPEN' first to open a file.") #Print an error message if the file is not open
+                    continue
+                try: #A key or value the file cannot hold (e.g. a negative number) is reported, the session goes on
+                    #Insert Command
+                    parse = btree.layout.parse #Turns what the user typed into a key or value of the file's key format
+                    if command == 'insert':
+                        key = parse(input("Enter key: ")) #Get the key from the user
+                        value = parse(input("Enter value: ")) #Get the value from the user
+                        btree.insert(key, value) #Insert the key-value pair into the B-Tree
+                    #Delete Command
+                    elif command == 'delete':
+                        key = parse(input("Enter key: ")) #Get the key from the user
+                        btree.delete(key) #Delete the key from the B-Tree
+                    #Search Command
+                    elif command == 'search':
+                        key = input("Enter key (or a file of keys for a batch search): ").strip() #Get the key or key file from the user
+                        if is_key_file(btree, key): #A file of keys is searched in one batch
+                            btree.search_batch(key)
+                        else:
+                            btree.search(parse(key), show_error=True) #Search for the key in the B-Tree
+                    #Range Command
+                    elif command == 'range':
+                        lo = parse(input("Enter lower key: ")) #Get the first key of the range from the user
+                        hi = parse(input("Enter upper key: ")) #Get the last key of the range from the user
+                        btree.range_search(lo, hi) #Print the key-value pairs in the range
+                except ValueError as e:
+                    print(f"Invalid key or value: {e}")
+                #Print Command
+                if command == 'print':
+                    btree.print_tree() #Print the key-value pairs in the B-Tree
+                #Extract Command
+                elif command == 'extract':
+                    output_file = input("Enter output file name: ").strip() #Get the output file name from the user
+                    btree.extract(output_file) #Extract the key-value pairs to a file
+                #Load Command
+                elif command == 'load': 
+                    input_file = input("Enter input file name: ").strip() #Get the input file name from the user
+                    bulk = input("Use sorted bulk load? (yes/no): ").strip().lower() == 'yes' #Bulk load builds an empty tree bottom-up
+                    btree.load(input_file, bulk=bulk) #Load the key-value pairs from the file
+                #Compact Command
+                elif command == 'compact':
+                    btree.compact() #Rewrite the index file into contiguous blocks
+                #Stats Command
+                elif command == 'stats':
+                    for name, value in btree.cache_stats().items(): #Print the buffer pool counters
+                        print(f"{name}: {value:.2%}" if name == 'hit_rate' else f"{name}: {value}")
+            #Quit Command
+            elif command == 'quit':
+                break #The file is closed on the way out
+            #Invalid Command
+            else:
+                print("Invalid command. Please try again.")
+    except (EOFError, KeyboardInterrupt): #End of input or ctrl-c quits like QUIT
+        print()
+    finally:
+        if btree: #Write back and close the file that is open
+            btree.close_file()
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,69 @@
+#Shared helpers of the regression tests: a scratch directory per test and a full check of a tree's invariants
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import main
+
+
+#Test case that runs in its own scratch directory and keeps the program's messages off the test output
+class TreeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.quiet = contextlib.redirect_stdout(io.StringIO())
+        self.quiet.__enter__()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.addCleanup(self.quiet.__exit__, None, None, None)
+    def path(self, name):
+        return os.path.join(self.directory, name)
+    #Walks the whole tree and checks that the keys are ordered and within the separators above them, that every
+    #leaf is at the same depth, that no node is too full (or, for fixed nodes, too empty) and that every block is
+    #either in the tree, an overflow page of a value in it or on the free list. Returns the (key, value) pairs in
+    #key order, with long values loaded
+    def check_tree(self, btree):
+        layout = btree.layout
+        pairs = []
+        depths = set()
+        used = {0} #The header block
+        def walk(block_id, depth, lo, hi):
+            node = btree.load_node(block_id)
+            used.add(block_id)
+            keys = [node.keys[i] for i in range(node.num_keys)]
+            self.assertEqual(keys, sorted(set(keys)))
+            for key in keys:
+                self.assertTrue((lo is None or key > lo) and (hi is None or key < hi))
+            if layout.key_format == main.KEYS_BYTES:
+                self.assertLessEqual(node.size(), layout.block_size)
+            else:
+                self.assertLessEqual(node.num_keys, layout.max_keys)
+                if block_id != btree.header.root_id:
+                    self.assertGreaterEqual(node.num_keys, layout.degree - 1)
+            for i in range(node.num_keys):
+                value = node.values[i]
+                if isinstance(value, main.OverflowRef):
+                    used.update(page for page, _ in btree._overflow_pages(value))
+            if node.is_leaf:
+                depths.add(depth)
+                pairs.extend((keys[i], btree._load_value(node.values[i])) for i in range(node.num_keys))
+                return
+            for i in range(node.num_keys + 1):
+                walk(node.children[i], depth + 1, keys[i - 1] if i > 0 else lo, keys[i] if i < node.num_keys else hi)
+                if i < node.num_keys:
+                    pairs.append((keys[i], btree._load_value(node.values[i])))
+        if btree.header.root_id:
+            walk(btree.header.root_id, 0, None, None)
+        self.assertLessEqual(len(depths), 1)
+        free = set()
+        block_id = btree.header.free_head
+        while block_id: #Follow the free list
+            self.assertNotIn(block_id, free)
+            free.add(block_id)
+            _, block_id, marker = main.NODE_HEAD_FORMAT.unpack_from(btree.storage.read_block(block_id), 0)
+            self.assertEqual(marker, main.FREE_BLOCK)
+        self.assertEqual(len(free), btree.header.free_count)
+        self.assertFalse(used & free)
+        self.assertEqual(used | free, set(range(btree.header.next_block_id)))
+        return pairs
@@ -0,0 +1,70 @@
+#Sorted bulk load of integer pairs: in memory and through sorted runs spilled to disk
+import random
+import unittest
+
+import main
+from tests.checks import TreeTestCase
+
+
+class BulkLoadTest(TreeTestCase):
+    def write_pairs(self, name, pairs):
+        with open(self.path(name), 'w') as f:
+            f.writelines(f"{key},{value}\n" for key, value in pairs)
+        return self.path(name)
+
+    #Duplicate keys keep their first value, in memory and when the input is sorted in runs on disk
+    def test_bulk_load(self):
+        rng = random.Random(1)
+        pairs = [(rng.randrange(5000), rng.randrange(2**64)) for _ in range(8000)]
+        expected = {}
+        for key, value in pairs:
+            expected.setdefault(key, value)
+        input_file = self.write_pairs('pairs.csv', pairs)
+        self.addCleanup(setattr, main, 'BULK_RUN_SIZE', main.BULK_RUN_SIZE)
+        for run_size in (main.BULK_RUN_SIZE, 700):
+            for degree in (2, 10):
+                with self.subTest(run_size=run_size, degree=degree):
+                    main.BULK_RUN_SIZE = run_size
+                    btree = main.BTree(self.path(f'bulk{run_size}_{degree}.db'))
+                    btree.create_file(512, degree)
+                    btree.bulk_load(input_file)
+                    self.assertEqual(self.check_tree(btree), sorted(expected.items()))
+                    btree.close_file()
+
+    #The tree a bulk load builds takes inserts and deletes like any other
+    def test_insert_after_bulk_load(self):
+        input_file = self.write_pairs('pairs.csv', ((key, key) for key in range(0, 3000, 2)))
+        btree = main.BTree(self.path('mixed.db'))
+        btree.create_file(512, 3)
+        btree.bulk_load(input_file)
+        for key in range(1, 3000, 2):
+            self.assertTrue(btree._insert(key, key))
+        for key in range(0, 3000, 3):
+            self.assertTrue(btree._delete(key))
+        self.assertEqual(self.check_tree(btree), [(key, key) for key in range(3000) if key % 3])
+        btree.close_file()
+
+    #A single pair makes a one leaf tree; an empty input leaves the tree empty
+    def test_small_inputs(self):
+        btree = main.BTree(self.path('small.db'))
+        btree.create_file(512)
+        btree.bulk_load(self.write_pairs('empty.csv', []))
+        self.assertEqual(btree.header.root_id, 0)
+        btree.bulk_load(self.write_pairs('one.csv', [(7, 8)]))
+        self.assertEqual(self.check_tree(btree), [(7, 8)])
+        btree.close_file()
+
+    #A bulk load only builds into an empty tree
+    def test_bulk_load_needs_empty_tree(self):
+        input_file = self.write_pairs('pairs.csv', [(1, 1), (2, 2)])
+        btree = main.BTree(self.path('bulk.db'))
+        btree.create_file(512)
+        btree._insert(5, 5)
+        with self.assertRaises(ValueError):
+            btree.bulk_load(input_file)
+        self.assertEqual(self.check_tree(btree), [(5, 5)])
+        btree.close_file()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#Files of byte string keys and values: slotted pages with prefix compressed keys and overflow pages
+import random
+import unittest
+
+import main
+from tests.checks import TreeTestCase
+
+
+def random_key(rng):
+    return rng.choice([b'', b'user:', b'user:profile:', b'order/2024/']) + str(rng.randrange(3000)).encode()
+
+def random_value(rng):
+    length = rng.randrange(20) if rng.random() < 0.8 else rng.randrange(100, 3000) #Some values need overflow pages
+    return bytes(rng.randrange(256) for _ in range(length))
+
+
+class ByteKeyTest(TreeTestCase):
+    #Random inserts and deletes checked against a dict; node sizes, separators and blocks are checked as well
+    def test_random_insert_delete(self):
+        for block_size in (512, 4096):
+            with self.subTest(block_size=block_size):
+                rng = random.Random(block_size)
+                btree = main.BTree(self.path(f'b{block_size}.db'))
+                btree.create_file(block_size, key_format=main.KEYS_BYTES)
+                expected = {}
+                for step in range(3000):
+                    key = random_key(rng)
+                    if rng.random() < 0.6:
+                        value = random_value(rng)
+                        self.assertEqual(btree._insert(key, value), key not in expected)
+                        expected.setdefault(key, value)
+                    else:
+                        self.assertEqual(bool(btree._delete(key)), key in expected)
+                        expected.pop(key, None)
+                    if step % 500 == 0:
+                        self.assertEqual(self.check_tree(btree), sorted(expected.items()))
+                btree.close_file()
+                btree = main.BTree(self.path(f'b{block_size}.db'))
+                btree.open_file()
+                self.assertEqual(self.check_tree(btree), sorted(expected.items()))
+                self.assertEqual(list(btree.scan(b'user:', b'user:~')),
+                                 sorted(pair for pair in expected.items() if b'user:' <= pair[0] <= b'user:~'))
+                for key in list(expected):
+                    self.assertTrue(btree._delete(key))
+                self.assertEqual(btree.header.free_count, btree.header.next_block_id - 1)
+                self.check_tree(btree)
+                btree.close_file()
+
+    #Bulk load (in memory and from sorted runs on disk), then COMPACT after deletes
+    def test_bulk_load_and_compact(self):
+        rng = random.Random(7)
+        pairs = {random_key(rng): random_value(rng) for _ in range(2000)}
+        with open(self.path('pairs.bin'), 'wb') as f:
+            f.write(main.encode_bytes_binary(list(pairs), list(pairs.values())))
+        deleted = set(list(pairs)[::2])
+        self.addCleanup(setattr, main, 'BULK_RUN_SIZE', main.BULK_RUN_SIZE)
+        for run_size in (main.BULK_RUN_SIZE, 300):
+            with self.subTest(run_size=run_size):
+                main.BULK_RUN_SIZE = run_size
+                btree = main.BTree(self.path(f'bulk{run_size}.db'))
+                btree.create_file(1024, key_format=main.KEYS_BYTES)
+                btree.bulk_load(self.path('pairs.bin'))
+                self.assertEqual(self.check_tree(btree), sorted(pairs.items()))
+                for key in deleted:
+                    btree._delete(key)
+                expected = sorted(pair for pair in pairs.items() if pair[0] not in deleted)
+                btree.compact()
+                self.assertEqual(btree.header.free_count, 0)
+                self.assertEqual(self.check_tree(btree), expected)
+                btree.close_file()
+
+    #EXTRACT and LOAD give back the same pairs in both formats, whatever bytes the keys and values hold
+    def test_extract_round_trip(self):
+        rng = random.Random(3)
+        btree = main.BTree(self.path('source.db'))
+        btree.create_file(1024, key_format=main.KEYS_BYTES)
+        expected = {}
+        for _ in range(500):
+            key = bytes(rng.randrange(256) for _ in range(rng.randrange(40)))
+            value = b'\r' + random_value(rng) + b'\n,"'
+            if btree._insert(key, value):
+                expected[key] = value
+        for name in ('pairs.csv', 'pairs.bin'):
+            with self.subTest(name=name):
+                self.assertTrue(btree.extract(self.path(name)))
+                copy = main.BTree(self.path(name + '.db'))
+                copy.create_file(1024, key_format=main.KEYS_BYTES)
+                self.assertTrue(copy.load(self.path(name), bulk=True))
+                self.assertEqual(self.check_tree(copy), sorted(expected.items()))
+                copy.close_file()
+        btree.close_file()
+
+    #Keys longer than the layout allows are refused
+    def test_key_too_long(self):
+        btree = main.BTree(self.path('long.db'))
+        btree.create_file(1024, key_format=main.KEYS_BYTES)
+        with self.assertRaises(ValueError):
+            btree._insert(b'k' * (btree.layout.max_inline + 1), b'v')
+        btree.close_file()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+#Delete with borrowing and merging, reuse of freed blocks and COMPACT on trees of fixed 64-bit keys
+import random
+import unittest
+
+import main
+from tests.checks import TreeTestCase
+
+
+class DeleteTest(TreeTestCase):
+    #Random inserts and deletes checked against a dict, at the smallest degrees (where every delete borrows or
+    #merges) and at the degree of the original file format
+    def test_random_insert_delete(self):
+        for degree in (2, 3, 10):
+            with self.subTest(degree=degree):
+                rng = random.Random(degree)
+                btree = main.BTree(self.path(f'd{degree}.db'))
+                btree.create_file(512, degree)
+                expected = {}
+                for step in range(3000):
+                    key = rng.randrange(500)
+                    if rng.random() < 0.55:
+                        value = rng.randrange(2**64)
+                        self.assertEqual(btree._insert(key, value), key not in expected)
+                        expected.setdefault(key, value)
+                    else:
+                        self.assertEqual(bool(btree._delete(key)), key in expected)
+                        expected.pop(key, None)
+                    if step % 500 == 0:
+                        self.assertEqual(self.check_tree(btree), sorted(expected.items()))
+                self.assertEqual(self.check_tree(btree), sorted(expected.items()))
+                btree.close_file()
+                btree = main.BTree(self.path(f'd{degree}.db'))
+                btree.open_file()
+                self.assertEqual(self.check_tree(btree), sorted(expected.items()))
+                btree.close_file()
+
+    #Deleting every key frees every block, and later inserts take them back before the file grows
+    def test_free_blocks_are_reused(self):
+        btree = main.BTree(self.path('free.db'))
+        btree.create_file(512, 3)
+        for key in range(1000):
+            btree._insert(key, key)
+        blocks = btree.header.next_block_id
+        for key in range(1000):
+            self.assertTrue(btree._delete(key))
+        self.assertEqual(btree.header.root_id, 0)
+        self.assertEqual(btree.header.free_count, blocks - 1)
+        self.check_tree(btree)
+        for key in range(1000):
+            btree._insert(key, key)
+        self.assertEqual(btree.header.next_block_id, blocks)
+        self.check_tree(btree)
+        btree.close_file()
+
+    #COMPACT keeps every pair and drops the free blocks
+    def test_compact(self):
+        btree = main.BTree(self.path('compact.db'))
+        btree.create_file(512, 2)
+        for key in range(2000):
+            btree._insert(key, key * 3)
+        for key in range(0, 2000, 3):
+            btree._delete(key)
+        expected = [(key, key * 3) for key in range(2000) if key % 3]
+        btree.compact()
+        self.assertEqual(btree.header.free_count, 0)
+        self.assertEqual(self.check_tree(btree), expected)
+        btree.close_file()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+#EXTRACT in CSV and binary, and LOAD of what it wrote
+import random
+import unittest
+
+import main
+from tests.checks import TreeTestCase
+
+
+class ExtractTest(TreeTestCase):
+    def test_extract_and_load(self):
+        rng = random.Random(8)
+        btree = main.BTree(self.path('source.db'))
+        btree.create_file(512, 3)
+        stored = {rng.randrange(2**64): rng.randrange(2**64) for _ in range(2000)}
+        stored[2**64 - 1] = 0
+        for key, value in stored.items():
+            btree._insert(key, value)
+        expected = sorted(stored.items())
+        self.addCleanup(setattr, main, 'EXPORT_BATCH_SIZE', main.EXPORT_BATCH_SIZE)
+        main.EXPORT_BATCH_SIZE = 300 #Several batches
+        for name in ('pairs.csv', 'pairs.bin'):
+            self.assertTrue(btree.extract(self.path(name), overwrite=True))
+        with open(self.path('pairs.csv')) as f:
+            self.assertEqual(f.read(), ''.join(f"{key},{value}\n" for key, value in expected))
+        with open(self.path('pairs.bin'), 'rb') as f:
+            self.assertEqual(list(main.read_binary_pairs(f)), expected)
+        btree.close_file()
+        for name in ('pairs.csv', 'pairs.bin'):
+            for bulk in (False, True):
+                with self.subTest(name=name, bulk=bulk):
+                    copy = main.BTree(self.path(f'{name}.{bulk}.db'))
+                    copy.create_file(1024)
+                    self.assertTrue(copy.load(self.path(name), bulk=bulk))
+                    self.assertEqual(self.check_tree(copy), expected)
+                    copy.close_file()
+
+    #The format can be given instead of taken from the file name; unknown formats and existing files are refused
+    def test_formats(self):
+        btree = main.BTree(self.path('formats.db'))
+        btree.create_file(512)
+        btree._insert(1, 2)
+        self.assertTrue(btree.extract(self.path('out.txt'), 'bin', overwrite=False))
+        with open(self.path('out.txt'), 'rb') as f:
+            self.assertEqual(f.read(), main.PAIR_FORMAT.pack(1, 2))
+        self.assertFalse(btree.extract(self.path('other.txt'), 'xml'))
+        with self.assertRaises(FileExistsError):
+            btree.extract(self.path('out.txt'), overwrite=False)
+        btree.close_file()
+
+
+if __name__ == '__main__':
+    unittest.main()
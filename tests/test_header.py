@@ -0,0 +1,54 @@
+#Block size and degree stored in the file header, and files from before they were stored
+import unittest
+
+import main
+from tests.checks import TreeTestCase
+
+
+class HeaderTest(TreeTestCase):
+    #A reopened file gets the block size and degree it was created with
+    def test_layout_is_stored(self):
+        for block_size, degree in ((512, None), (4096, None), (1024, 4)):
+            with self.subTest(block_size=block_size, degree=degree):
+                name = self.path(f'h{block_size}.db')
+                btree = main.BTree(name)
+                btree.create_file(block_size, degree)
+                for key in range(2000):
+                    btree._insert(key, key + 1)
+                btree.close_file()
+                btree = main.BTree(name)
+                btree.open_file()
+                self.assertEqual(btree.layout.block_size, block_size)
+                self.assertEqual(btree.layout.degree, degree or main.max_degree(block_size))
+                self.assertEqual(self.check_tree(btree), [(key, key + 1) for key in range(2000)])
+                btree.close_file()
+
+    #A header with a block size and degree of 0 is a file from before they were stored: 512 byte blocks, degree 10
+    def test_legacy_header(self):
+        name = self.path('legacy.db')
+        btree = main.BTree(name)
+        btree.create_file(main.BLOCK_SIZE, main.DEGREE)
+        for key in range(500):
+            btree._insert(key, key * 2)
+        btree.close_file()
+        with open(name, 'r+b') as f: #Clear the block size and degree fields
+            f.seek(24)
+            f.write(bytes(16))
+        btree = main.BTree(name)
+        btree.open_file()
+        self.assertEqual((btree.layout.block_size, btree.layout.degree), (main.BLOCK_SIZE, main.DEGREE))
+        self.assertEqual(self.check_tree(btree), [(key, key * 2) for key in range(500)])
+        btree._insert(1000, 1)
+        btree.close_file()
+
+    #Block sizes that are not a power of two in range, and degrees whose nodes do not fit, are refused
+    def test_invalid_layouts(self):
+        btree = main.BTree(self.path('bad.db'))
+        for block_size, degree in ((700, None), (256, None), (512, main.max_degree(512) + 1), (512, 1)):
+            with self.subTest(block_size=block_size, degree=degree):
+                with self.assertRaises(ValueError):
+                    btree.create_file(block_size, degree, overwrite=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+#Range scans of integer trees: inclusive bounds, open ends and empty ranges
+import random
+import unittest
+
+import main
+from tests.checks import TreeTestCase
+
+
+class ScanTest(TreeTestCase):
+    def test_scan_bounds(self):
+        rng = random.Random(4)
+        btree = main.BTree(self.path('scan.db'))
+        btree.create_file(512, 3)
+        keys = sorted(rng.sample(range(10000), 1500))
+        for key in keys:
+            btree._insert(key, key + 7)
+        self.check_tree(btree)
+        bounds = [None, 0, keys[0], keys[-1], 10000, 2**64 - 1] + rng.sample(keys, 20) + rng.sample(range(10000), 20)
+        for _ in range(300):
+            lo, hi = rng.choice(bounds), rng.choice(bounds)
+            expected = [(key, key + 7) for key in keys if (lo is None or key >= lo) and (hi is None or key <= hi)]
+            self.assertEqual(list(btree.scan(lo, hi)), expected, (lo, hi))
+        btree.close_file()
+
+    #A scan stopped early leaves the tree usable
+    def test_partial_scan(self):
+        btree = main.BTree(self.path('partial.db'))
+        btree.create_file(512, 2)
+        for key in range(200):
+            btree._insert(key, key)
+        scan = btree.scan(50)
+        self.assertEqual([next(scan) for _ in range(3)], [(50, 50), (51, 51), (52, 52)])
+        scan.close()
+        self.assertEqual(list(btree.scan(198)), [(198, 198), (199, 199)])
+        self.assertEqual(list(btree.scan(5, 4)), [])
+        btree.close_file()
+
+    def test_empty_tree(self):
+        btree = main.BTree(self.path('empty.db'))
+        btree.create_file(512)
+        self.assertEqual(list(btree.scan()), [])
+        btree.close_file()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+#Batched lookups: one shared walk of the tree answers every key
+import random
+import unittest
+
+import main
+from tests.checks import TreeTestCase
+
+
+class SearchManyTest(TreeTestCase):
+    def test_search_many(self):
+        rng = random.Random(6)
+        for degree in (2, 10):
+            with self.subTest(degree=degree):
+                btree = main.BTree(self.path(f'many{degree}.db'))
+                btree.create_file(512, degree)
+                stored = {key: rng.randrange(2**64) for key in rng.sample(range(20000), 3000)}
+                for key, value in stored.items():
+                    btree._insert(key, value)
+                #Unsorted, with duplicates, keys not in the tree and both ends of the key range
+                keys = rng.sample(list(stored), 500) + [rng.randrange(20000) for _ in range(500)] + [0, 2**64 - 1]
+                keys += keys[:50]
+                self.assertEqual(btree.search_many(keys), {key: stored.get(key) for key in keys})
+                self.assertEqual(btree.search_many([]), {})
+                btree.close_file()
+
+    def test_empty_tree(self):
+        btree = main.BTree(self.path('empty.db'))
+        btree.create_file(512)
+        self.assertEqual(btree.search_many([1, 2]), {1: None, 2: None})
+        btree.close_file()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+#Answers of the query server to single requests (IndexServer.answer, without a socket)
+import unittest
+
+import main
+from tests.checks import TreeTestCase
+
+
+class ServerTest(TreeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.btree = main.BTree(self.path('server.db'))
+        self.btree.create_file(512)
+        self.addCleanup(self.btree.close_file)
+        self.server = main.IndexServer(self.btree)
+    def ask(self, line):
+        return self.server.answer(line.split()).decode()
+
+    def test_requests(self):
+        self.assertEqual(self.ask('GET 1'), 'NOT_FOUND\n')
+        self.assertEqual(self.ask('PUT 1 10'), 'OK\n')
+        self.assertEqual(self.ask('PUT 1 11'), 'EXISTS\n')
+        self.assertEqual(self.ask('PUT 2 20'), 'OK\n')
+        self.assertEqual(self.ask('GET 1'), 'VALUE 10\n')
+        self.assertEqual(self.ask('RANGE 0 5'), '1 10\n2 20\nEND 2\n')
+        self.assertEqual(self.ask('RANGE 0 5 1'), '1 10\nEND 1\n')
+        self.assertEqual(self.ask('DELETE 1'), 'OK\n')
+        self.assertEqual(self.ask('DELETE 1'), 'NOT_FOUND\n')
+
+    def test_bad_requests(self):
+        for line in ('RANGE 0 5 -1', 'GET x', 'PUT 1', 'GET 18446744073709551616', 'FOO'):
+            with self.subTest(line=line):
+                self.assertTrue(self.ask(line).startswith('ERROR'))
+
+
+if __name__ == '__main__':
+    unittest.main()
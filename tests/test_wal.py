@@ -0,0 +1,57 @@
+#Crash recovery from the write-ahead log: a process that stops without closing the tree leaves a log that the
+#next open replays
+import os
+import subprocess
+import sys
+import textwrap
+import unittest
+
+import main
+from tests.checks import TreeTestCase
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class WalTest(TreeTestCase):
+    #Runs a script in a new process that ends with os._exit, so nothing is written back or checkpointed
+    def crash(self, script):
+        code = f"import os, sys\nsys.path.insert(0, {ROOT!r})\nimport main\n" + textwrap.dedent(script) + "\nos._exit(0)\n"
+        subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.DEVNULL, cwd=self.directory)
+
+    #Every commit synced before the crash is recovered, and the tree is whole
+    def test_replay_after_crash(self):
+        self.crash("""
+            btree = main.BTree('w.db', wal=True, group_size=16)
+            btree.create_file(512, 3)
+            for key in range(500):
+                btree.insert(key, key + 1)
+            for key in range(0, 500, 2):
+                btree.delete(key)
+            btree.flush()
+            for key in range(1000, 1010): #Not synced: may or may not survive, but never in part
+                btree.insert(key, key)
+        """)
+        self.assertGreater(os.path.getsize(self.path('w.db.wal')), 0)
+        btree = main.BTree(self.path('w.db'), wal=True)
+        btree.open_file()
+        pairs = self.check_tree(btree)
+        self.assertEqual([pair for pair in pairs if pair[0] < 1000], [(key, key + 1) for key in range(1, 500, 2)])
+        btree.close_file()
+
+    #sync_due makes a waiting group durable once its interval has passed, without another commit
+    def test_sync_due(self):
+        btree = main.BTree(self.path('due.db'), wal=True, commit_interval=0)
+        btree.create_file(512)
+        btree.insert(1, 2)
+        btree.storage.wal.commit_interval = 3600
+        btree.insert(3, 4)
+        self.assertEqual(btree.storage.wal.waiting, 1)
+        btree.storage.wal.commit_interval = 0
+        btree.sync_due()
+        self.assertEqual(btree.storage.wal.waiting, 0)
+        self.assertEqual(btree.storage.wal.synced, btree.storage.wal.commits)
+        btree.close_file()
+
+
+if __name__ == '__main__':
+    unittest.main()